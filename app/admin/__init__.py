@@ -1,9 +1,11 @@
 from flask import Blueprint, g
 from flask_restful import Api
 from flask_login import current_user
+from utils.serialization import output_json
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 api = Api(admin_bp, prefix='/api')
+api.representations['application/json'] = output_json
 
 @admin_bp.before_request
 def before_request():
@@ -12,16 +14,20 @@ def before_request():
 def init_admin():
     from .resources import (UserResource, ModuleResource, ReviewResource, 
                             ModuleCodePrefixResource, ModuleReminderResource,
-                            UserEmailResource)
-    from .utils import ModuleUploadResource
+                            UserEmailResource, OutboxResource, OutboxRunResource)
+    from .utils import ModuleUploadResource, ModuleUploadJobResource, ModuleUploadReapplyResource
     
     # Add resources without /api prefix since it's handled by Api instance
     api.add_resource(UserResource, '/users', '/users/<user_id>')
     api.add_resource(ModuleResource, '/modules', '/modules/<module_id>')
     api.add_resource(ReviewResource, '/reviews', '/reviews/<review_id>', '/reviews/module/<module_id>')
     api.add_resource(ModuleUploadResource, '/modules/upload')
+    api.add_resource(ModuleUploadJobResource, '/modules/upload/<job_id>')
+    api.add_resource(ModuleUploadReapplyResource, '/modules/upload/<job_id>/reapply')
     api.add_resource(ModuleCodePrefixResource, "/modules/code_prefixes")
     api.add_resource(ModuleReminderResource, '/api/admin/modules/send-reminders')
     api.add_resource(UserEmailResource, '/api/users/<user_id>/email')
+    api.add_resource(OutboxResource, '/outbox/<batch_id>')
+    api.add_resource(OutboxRunResource, '/outbox/runs')
     from . import routes  
     return admin_bp
@@ -1,8 +1,13 @@
 from flask_wtf.file import FileField, FileRequired, FileAllowed
 from flask_wtf import FlaskForm
+from wtforms import SelectField
 
 class UploadForm(FlaskForm):
     file = FileField('Excel File', validators=[
         FileRequired(),
         FileAllowed(['xlsx', 'xls'], 'Excel files only!')
-    ])
\ No newline at end of file
+    ])
+    mode = SelectField('Existing Modules', choices=[
+        ('insert', 'Skip modules that already exist'),
+        ('sync', 'Update modules that already exist')
+    ], default='insert')
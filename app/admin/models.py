@@ -1,6 +1,10 @@
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 from extensions import mongo
+from services.loaders import get_user_loader
+from services.search import module_search_keys
 
 class User:
     collection = mongo.db.users
@@ -59,11 +63,15 @@ class Module:
             "module_lead_id": ObjectId(module_lead_id),
             "module_lead_name": module_lead_name,  # Storing module lead's name directly
             "academic_year": academic_year,
+            "search_keys": module_search_keys(module_code, module_name, module_lead and module_lead["username"]),
             "review_submitted": False,
             "created_at": datetime.utcnow(),
             "in_use": in_use
         }
-        return Module.collection.insert_one(module)
+        try:
+            return Module.collection.insert_one(module)
+        except DuplicateKeyError:
+            raise ValueError(f"Module code {module_code} already exists for academic year {academic_year}")
 
 
     @staticmethod
@@ -103,10 +111,12 @@ class Module:
             modules = list(Module.collection.aggregate(pipeline))
             print(f"Pipeline result: {modules}")  # Debug log
             
-            # Enhance modules with lead information
+            # Enhance modules with lead information, fetching all leads with one query
+            loader = get_user_loader()
+            loader.prime(module.get("module_lead_id") for module in modules)
             for module in modules:
                 if "module_lead_id" in module and isinstance(module["module_lead_id"], ObjectId):
-                    user = User.get_user_by_id(module["module_lead_id"])
+                    user = loader.load(module["module_lead_id"])
                     if user:
                         module["module_lead"] = user["username"]
                         module["module_lead_email"] = user["email"]
@@ -163,7 +173,7 @@ class Module:
         module = Module.collection.find_one({"_id": ObjectId(module_id)})
         
         if module and "module_lead_id" in module and isinstance(module["module_lead_id"], ObjectId):
-            module_lead = User.get_user_by_id(module["module_lead_id"])
+            module_lead = get_user_loader().load(module["module_lead_id"])
             if module_lead:
                 module["module_lead"] = module_lead["username"]
                 module["module_lead_email"] = module_lead["email"]
@@ -175,7 +185,8 @@ class Module:
 
     @staticmethod
     def update_review_status(module_id, reviewer_id):
-        return Module.collection.update_one(
+        """Mark a module as reviewed and return the module as it was before the update"""
+        return Module.collection.find_one_and_update(
             {"_id": ObjectId(module_id)},
             {
                 "$set": {
@@ -183,7 +194,9 @@ class Module:
                     "reviewed_by": ObjectId(reviewer_id),
                     "review_date": datetime.utcnow()
                 }
-            }
+            },
+            projection={"academic_year": 1, "module_lead_id": 1, "review_submitted": 1},
+            return_document=ReturnDocument.BEFORE
         )
 
     @staticmethod
@@ -1,4 +1,3 @@
-import requests
 from flask import render_template, redirect, url_for, flash, request, jsonify, session
 from flask_login import login_required, current_user
 from . import admin_bp
@@ -13,25 +12,16 @@ from base.utils import get_academic_year
 import logging as logger
 from .resources import ModuleReminderResource
 from .resources import UserEmailResource
-import pandas as pd  
-from io import BytesIO 
-from flask import send_file  
-
-# API configuration
-API_BASE_URL = "http://localhost:5000/admin/api"
-
-def make_request(method, endpoint, **kwargs):
-    """Helper function to make API requests with session cookies"""
-    url = f"{API_BASE_URL}{endpoint}"
-    cookies = {'session': session.get('_id')}
-    kwargs.update({'cookies': cookies})
-    
-    try:
-        response = requests.request(method, url, **kwargs)
-        return response
-    except Exception as e:
-        print(f"API Request Error: {str(e)}")
-        raise
+from .resources import format_response
+from .utils import ModuleUploadResource
+from services import users as users_service
+from services import modules as modules_service
+from services import reviews as reviews_service
+from services import counters
+from services import upload_jobs
+from services.loaders import get_user_loader
+from services import exports
+from flask import Response, send_file, stream_with_context
 
 def extract_object_id(id_str):
     """Helper function to extract ObjectId from various formats"""
@@ -77,33 +67,16 @@ def dashboard():
     }
     
     try:
-        # Get module counts with academic year filter
-        response = make_request('GET', '/modules', params={
-            "count_only": "true",
-            "academic_year": current_academic_year
+        # Module counts for the year and user counts come from the counters documents
+        counts = counters.get_dashboard_counts(current_academic_year)
+        stats.update({
+            "total_modules": counts["modules"]["total"],
+            "pending_reviews": counts["modules"]["pending"],
+            "completed_reviews": counts["modules"]["completed"],
+            "total_users": counts["users"]["total"],
+            "admin_users": counts["users"]["admin"],
+            "module_leads": counts["users"]["module_lead"]
         })
-        
-        if response.status_code == 200:
-            module_data = response.json()
-            if module_data.get("success"):
-                counts = module_data.get("data", {}).get("counts", {})
-                stats.update({
-                    "total_modules": counts.get("total", 0),
-                    "pending_reviews": counts.get("pending", 0),
-                    "completed_reviews": counts.get("completed", 0)
-                })
-        
-        # Get user counts (users are not filtered by academic year)
-        response_users = make_request('GET', '/users', params={"count_only": "true"})
-        if response_users.status_code == 200:
-            user_data = response_users.json()
-            if user_data.get("success"):
-                counts = user_data.get("data", {}).get("counts", {})
-                stats.update({
-                    "total_users": counts.get("total", 0),
-                    "admin_users": counts.get("admin", 0),
-                    "module_leads": counts.get("module_lead", 0)
-                })
 
     except Exception as e:
         print(f"Error in dashboard: {str(e)}")
@@ -127,42 +100,42 @@ def view_users():
     page = request.args.get("page", 1, type=int)
     per_page = 20
 
-    params = {
-        "search": search_query,
-        "page": page,
-        "per_page": per_page,
-        "sort": sort_by,
-        "direction": sort_direction
-    }
-    
-    # Add status filter to API params
+    # Map status filter to is_active
+    is_active = None
     if status_filter == "active":
-        params["is_active"] = True
+        is_active = True
     elif status_filter == "flagged":
-        params["is_active"] = False
+        is_active = False
     
-    response = make_request('GET', '/users', params=params)
-    if response.status_code == 200:
-        data = response.json().get('data', {})
-        users = data.get('items', [])
-        total_users = data.get('total', 0)
+    try:
+        data = users_service.list_users(
+            search=search_query,
+            is_active=is_active,
+            sort_field=sort_by,
+            sort_direction=-1 if sort_direction == "desc" else 1,
+            page=page,
+            per_page=per_page
+        )
+        users = data['items']
+        total_users = data['total']
         total_pages = (total_users + per_page - 1) // per_page
-    else:
+    except Exception as e:
+        print(f"Error fetching users: {str(e)}")
         users = []
         total_users = 0
         total_pages = 1
 
     if form.validate_on_submit():
-        data = {
-            "username": form.username.data,
-            "email": form.email.data,
-            "password": form.password.data,
-            "role": form.role.data,
-        }
-        res = make_request('POST', '/users', json=data)
-        if res.status_code == 201:
+        try:
+            users_service.create_user(
+                form.username.data,
+                form.email.data,
+                form.password.data,
+                form.role.data
+            )
             flash("User created successfully!", "success")
-        else:
+        except Exception as e:
+            print(f"Error creating user: {str(e)}")
             flash("Error creating user", "danger")
         return redirect(url_for('admin.view_users'))
 
@@ -184,33 +157,13 @@ def view_users():
 @admin_required
 def toggle_user_status(user_id):
     try:
-        print(f"Toggling status for user_id: {user_id}")  # Debug print
-        
-        # Clean the user ID first
-        if isinstance(user_id, dict) and '$oid' in user_id:
-            user_id = user_id['$oid']
-        else:
-            user_id = str(user_id)
-        
-        print(f"Cleaned user_id: {user_id}")  # Debug print
+        clean_id = extract_object_id(user_id)
+        if not clean_id:
+            flash("Error: Invalid user ID format", "danger")
+            return redirect(url_for('admin.view_users'))
         
         # Get current user status
-        response = make_request('GET', f'/users/{user_id}')
-        print(f"GET Response: {response.status_code}")  # Debug print
-        print(f"GET Response content: {response.text}")  # Debug print
-        
-        try:
-            response_data = response.json()
-        except ValueError as e:
-            print(f"JSON decode error: {str(e)}")  # Debug print
-            flash("Error: Invalid server response", "danger")
-            return redirect(url_for('admin.view_users'))
-
-        if not response_data or not response_data.get('success'):
-            flash("Error: " + response_data.get('message', 'Failed to get user data'), "danger")
-            return redirect(url_for('admin.view_users'))
-
-        user_data = response_data.get('data')
+        user_data = users_service.get_user(clean_id)
         if not user_data:
             flash("Error: User data not found", "danger")
             return redirect(url_for('admin.view_users'))
@@ -218,25 +171,12 @@ def toggle_user_status(user_id):
         current_status = user_data.get('is_active', True)
         
         # Toggle the status
-        update_data = {"is_active": not current_status}
-        print(f"Sending update: {update_data}")  # Debug print
-        
-        update_response = make_request('PUT', f'/users/{user_id}', json=update_data)
-        print(f"PUT Response: {update_response.status_code}")  # Debug print
-        print(f"PUT Response content: {update_response.text}")  # Debug print
-        
-        try:
-            update_result = update_response.json()
-        except ValueError:
-            flash("Error: Invalid response during update", "danger")
-            return redirect(url_for('admin.view_users'))
-
-        if update_response.status_code == 200 and update_result.get('success'):
+        updated_user = users_service.update_user(clean_id, {"is_active": not current_status})
+        if updated_user:
             status_text = "unblocked" if not current_status else "blocked"
             flash(f"User has been {status_text} successfully", "success")
         else:
-            error_msg = update_result.get('message', 'Failed to update user status')
-            flash(f"Error: {error_msg}", "danger")
+            flash("Error: Failed to update user status", "danger")
             
         return redirect(url_for('admin.view_users'))
         
@@ -274,31 +214,19 @@ def create_user():
                 "errors": missing_fields
             }), 400
 
-        # Make API request
-        response = make_request('POST', '/users', json=data)
-        print(f"API response: {response.status_code}, {response.text}")  # Debug print
-
         try:
-            result = response.json()
-            if response.status_code == 201:
-                return jsonify({
-                    "success": True,
-                    "message": "User created successfully"
-                })
-
+            users_service.create_user(data["username"], data["email"], data["password"], data["role"])
             return jsonify({
-                "success": False,
-                "message": result.get('message', 'Error creating user'),
-                "errors": result.get('errors', {"general": ["Failed to create user"]})
-            }), 400
+                "success": True,
+                "message": "User created successfully"
+            })
 
         except ValueError as e:
-            print(f"JSON decode error: {str(e)}")  # Debug print
             return jsonify({
                 "success": False,
-                "message": "Invalid server response",
-                "errors": {"general": ["Server error occurred"]}
-            }), 500
+                "message": str(e),
+                "errors": {"general": [str(e)]}
+            }), 400
 
     except Exception as e:
         print(f"Error creating user: {str(e)}")  # Debug print
@@ -339,67 +267,31 @@ def view_modules():
     # Create an instance of the upload form
     upload_form = UploadForm()
 
-    # Construct API parameters
-    params = {
-        "search": search_query,
-        "page": page,
-        "per_page": per_page,
-        "sort": sort_by,
-        "direction": sort_direction,
-        "academic_year": current_academic_year  # Always include current academic year
-    }
-
-    # Add filters to params
-    if status_filter == "pending":
-        params["review_status"] = "pending"
-    elif status_filter == "reviewed":
-        params["review_status"] = "reviewed"
-
-    if code_prefix:
-        clean_prefix = code_prefix.strip().upper()
-        if clean_prefix:
-            params["code_prefix"] = clean_prefix
-
-    # Make API request to fetch modules
-    response = make_request('GET', '/modules', params=params)
+    review_status = status_filter if status_filter in ("pending", "reviewed") else None
     
     modules = []
     total_modules = 0
     total_pages = 0
     reviewers = {}
 
-    if response.status_code == 200:
-        data = response.json().get('data', {})
-        modules = data.get('items', [])
-        total_modules = data.get('total', 0)
+    try:
+        data = modules_service.list_modules(
+            search=search_query,
+            review_status=review_status,
+            academic_year=current_academic_year,  # Always include current academic year
+            code_prefix=code_prefix.upper() or None,
+            sort_field=sort_by,
+            sort_direction=-1 if sort_direction == "desc" else 1,
+            page=page,
+            per_page=per_page
+        )
+        modules = data['items']
+        total_modules = data['total']
         total_pages = (total_modules + per_page - 1) // per_page
 
-        # Fetch reviewer information for all modules
-        reviewer_ids = set()
-        for module in modules:
-            if module.get('reviewed_by'):
-                if isinstance(module['reviewed_by'], dict):
-                    reviewer_id = module['reviewed_by'].get('$oid')
-                else:
-                    reviewer_id = str(module['reviewed_by'])
-                if reviewer_id:
-                    reviewer_ids.add(reviewer_id)
-
-        # Get reviewer names in bulk if there are any reviewers
-        if reviewer_ids:
-            try:
-                users_response = make_request('GET', '/users', params={
-                    'ids': list(reviewer_ids),
-                    'per_page': 0  
-                })
-                if users_response.status_code == 200:
-                    users_data = users_response.json().get('data', {}).get('items', [])
-                    reviewers = {
-                        str(user.get('_id', {}).get('$oid')): user.get('username')
-                        for user in users_data
-                    }
-            except Exception as e:
-                print(f"Error fetching reviewers: {e}")
+        # Fetch module leads and reviewers for the whole page with one query
+        get_user_loader().prime(m.get('module_lead_id') for m in modules)
+        reviewers = get_user_names(m.get('reviewed_by') for m in modules)
 
         # Enhance module data with module lead information
         for module in modules:
@@ -408,19 +300,13 @@ def view_modules():
             
             # Format review information
             if module.get('reviewed_by'):
-                if isinstance(module['reviewed_by'], dict):
-                    reviewer_id = module['reviewed_by'].get('$oid')
-                else:
-                    reviewer_id = str(module['reviewed_by'])
-                module['reviewer_name'] = reviewers.get(reviewer_id, 'Unknown')
+                module['reviewer_name'] = reviewers.get(str(module['reviewed_by']), 'Unknown')
+    except Exception as e:
+        print(f"Error fetching modules: {str(e)}")
 
     # Fetch distinct code prefixes for dropdown
     try:
-        prefix_response = make_request('GET', '/modules/code_prefixes')
-        if prefix_response.status_code == 200:
-            code_prefixes = prefix_response.json().get('data', {}).get('code_prefixes', [])
-        else:
-            code_prefixes = []
+        code_prefixes = modules_service.get_code_prefixes()
     except Exception as e:
         print(f"Error fetching code prefixes: {str(e)}")
         code_prefixes = []
@@ -457,85 +343,49 @@ def view_completed_modules():
     current_academic_year = get_academic_year()
 
     try:
-        params = {
-            "search": search_query,
-            "page": page,
-            "per_page": per_page,
-            "review_status": "reviewed",
-            "sort": sort_by,
-            "direction": sort_direction,
-            "academic_year": current_academic_year  # Always use global academic year
-        }
-
-        # Add code prefix filter if provided
-        if code_prefix:
-            params["code_prefix"] = code_prefix.upper()
+        data = modules_service.list_modules(
+            search=search_query,
+            review_status="reviewed",
+            academic_year=current_academic_year,  # Always use global academic year
+            code_prefix=code_prefix.upper() or None,
+            sort_field=sort_by,
+            sort_direction=-1 if sort_direction == "desc" else 1,
+            page=page,
+            per_page=per_page
+        )
+        modules = data['items']
+        total_modules = data['total']
+        total_pages = (total_modules + per_page - 1) // per_page
         
-        response = make_request('GET', '/modules', params=params)
-        print(f"API Response: {response.status_code}, {response.text}")  # Debug print
+        # Get reviewer names for all modules
+        reviewers = get_user_names(m.get('reviewed_by') for m in modules)
         
-        if response.status_code == 200:
-            data = response.json().get('data', {})
-            modules = data.get('items', [])
-            total_modules = data.get('total', 0)
-            total_pages = (total_modules + per_page - 1) // per_page
-            
-            # Get reviewer names for all modules
-            reviewer_ids = [str(m.get('reviewed_by', {}).get('$oid')) for m in modules if m.get('reviewed_by')]
-            reviewers = {}
-            
-            if reviewer_ids:
-                users_response = make_request('GET', '/users', params={
-                    'ids': list(reviewer_ids),
-                    'per_page': 0  
-                })
-                if users_response.status_code == 200:
-                    users = users_response.json().get('data', {}).get('items', [])
-                    reviewers = {str(user.get('_id', {}).get('$oid')): user.get('username') for user in users}
-            
-            # Add reviewer names to modules
-            for module in modules:
-                reviewer_id = str(module.get('reviewed_by', {}).get('$oid', ''))
-                module['reviewer_name'] = reviewers.get(reviewer_id, 'Unknown')
-
-            # Return JSON for AJAX requests
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return jsonify({
-                    "success": True,
-                    "data": {
-                        "modules": modules,
-                        "total": total_modules,
-                        "page": page,
-                        "pages": total_pages
-                    }
-                })
-            
-            # Fetch distinct code prefixes
-            prefix_response = make_request('GET', '/modules/code_prefixes')
-            if prefix_response.status_code == 200:
-                code_prefixes = prefix_response.json().get('data', {}).get('code_prefixes', [])
-            else:
-                code_prefixes = []
-            
-            # Regular template render for initial page load
-            return render_template(
-                "admin/completed_modules.html",
-                modules=modules,
-                total_modules=total_modules,
-                total_pages=total_pages,
-                page=page,
-                search_query=search_query,
-                sort_by=sort_by,
-                sort_direction=sort_direction,
-                code_prefix=code_prefix,
-                code_prefixes=code_prefixes
-            )
-            
-        else:
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return jsonify({"success": False, "message": "Failed to load modules"}), 400
-            flash("Error loading completed modules", "danger")
-            return render_template("admin/completed_modules.html", total_pages=1)
+        # Add reviewer names to modules
+        for module in modules:
+            module['reviewer_name'] = reviewers.get(str(module.get('reviewed_by', '')), 'Unknown')
+
+        # Return JSON for AJAX requests
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify(format_response({
+                "modules": modules,
+                "total": total_modules,
+                "page": page,
+                "pages": total_pages
+            }))
+        
+        # Regular template render for initial page load
+        return render_template(
+            "admin/completed_modules.html",
+            modules=modules,
+            total_modules=total_modules,
+            total_pages=total_pages,
+            page=page,
+            search_query=search_query,
+            sort_by=sort_by,
+            sort_direction=sort_direction,
+            code_prefix=code_prefix,
+            code_prefixes=modules_service.get_code_prefixes()
+        )
             
     except Exception as e:
         print(f"Error: {str(e)}")  # Debug print
@@ -563,39 +413,31 @@ def view_pending_modules():
     # Get current academic year from global setting
     current_academic_year = get_academic_year()
 
-    params = {
-        "search": search_query,
-        "page": page,
-        "per_page": per_page,
-        "review_status": "pending",
-        "sort": sort_by,
-        "direction": sort_direction,
-        "academic_year": current_academic_year  # Always use global academic year
-    }
-
-    # Add code prefix filter if provided
-    if code_prefix:
-        params["code_prefix"] = code_prefix.upper()
-
     # Fetch modules
-    response = make_request('GET', '/modules', params=params)
     modules = []
     total_modules = 0
     total_pages = 0
 
-    if response.status_code == 200:
-        data = response.json().get('data', {})
-        modules = data.get('items', [])
-        total_modules = data.get('total', 0)
+    try:
+        data = modules_service.list_modules(
+            search=search_query,
+            review_status="pending",
+            academic_year=current_academic_year,  # Always use global academic year
+            code_prefix=code_prefix.upper() or None,
+            sort_field=sort_by,
+            sort_direction=-1 if sort_direction == "desc" else 1,
+            page=page,
+            per_page=per_page
+        )
+        modules = data['items']
+        total_modules = data['total']
         total_pages = (total_modules + per_page - 1) // per_page
+    except Exception as e:
+        print(f"Error fetching modules: {str(e)}")
 
     # Fetch distinct code prefixes
     try:
-        prefix_response = make_request('GET', '/modules/code_prefixes')
-        if prefix_response.status_code == 200:
-            code_prefixes = prefix_response.json().get('data', {}).get('code_prefixes', [])
-        else:
-            code_prefixes = []
+        code_prefixes = modules_service.get_code_prefixes()
     except Exception as e:
         print(f"Error fetching code prefixes: {str(e)}")
         code_prefixes = []
@@ -627,47 +469,35 @@ def upload_modules():
         }), 400
 
     try:
-        file = form.file.data
-        files = {"file": (file.filename, file.read(), file.mimetype)}
-        response = make_request('POST', '/modules/upload', files=files)
-        result = response.json()
-        
-        print(f"Upload API Response: {result}")  # Debug print
-
-        if response.status_code in [200, 206]:
-            # Store only essential data in session
-            warnings = result['data']['warnings']
-            errors = result['data']['errors']
-            stats = result['data']['stats']
-            
-            # Truncate long messages to reduce size
-            truncated_warnings = [w[:200] for w in warnings[:50]]
-            truncated_errors = [e[:200] for e in errors[:50]]
-            
-            session['upload_summary'] = {
-                'stats': {
-                    'total_processed': stats.get('total_processed', 0),
-                    'users_added': stats.get('users_added', 0),
-                    'modules_added': stats.get('modules_added', 0),
-                    'academic_year': stats.get('academic_year', datetime.utcnow().year)  # Provide default value
-                },
-                'warnings': truncated_warnings,
-                'errors': truncated_errors,
-                'timestamp': datetime.utcnow().isoformat(),
-                'has_more_warnings': len(warnings) > 50,
-                'has_more_errors': len(errors) > 50
-            }
+        # The upload resource reads the file from the current request and queues a job
+        result, status_code = ModuleUploadResource().post()
+        if not isinstance(result, dict):
+            result = result.get_json()
+
+        cached = status_code == 200 and result['data'].get('cached')
+        if status_code == 200 and not cached:
+            # Dry runs return their diff straight away
+            return jsonify(result)
+
+        if status_code == 202 or cached:
+            job_id = str(result['data']['job_id'])
+            # Only the job ID goes in the session; the summary is read from the job
+            session['upload_job_id'] = job_id
+            if cached:
+                flash("This file was already processed, nothing was saved. Showing the earlier upload's results.", "info")
             
             return jsonify({
                 "success": True,
                 "message": result['message'],
-                "redirect": url_for('admin.upload_summary')
+                "job_id": job_id,
+                "status_url": result['data']['status_url'],
+                "redirect": url_for('admin.upload_summary', job_id=job_id)
             })
         else:
             return jsonify({
                 "success": False,
                 "message": result.get('message', 'Upload failed')
-            }), response.status_code
+            }), status_code
 
     except Exception as e:
         print(f"Upload error: {str(e)}")  # Debug print
@@ -678,34 +508,42 @@ def upload_modules():
 
 
 @admin_bp.route("/modules/upload/summary")
+@admin_bp.route("/modules/upload/summary/<job_id>")
 @login_required
 @admin_required
-def upload_summary():
-    summary = session.get('upload_summary')
-    if not summary:
+def upload_summary(job_id=None):
+    job_id = job_id or session.get('upload_job_id')
+    job = upload_jobs.get_job(job_id) if job_id and ObjectId.is_valid(job_id) else None
+    if not job:
         flash("No upload summary available", "warning")
         return redirect(url_for('admin.view_modules'))
 
-    # Convert timestamp back to datetime
-    try:
-        timestamp = datetime.fromisoformat(summary.get('timestamp', ''))
-    except (ValueError, TypeError):
-        timestamp = datetime.utcnow()
+    status = upload_jobs.job_status(job)
+    progress = status['progress']
 
+    # Only the first 50 of each are listed, truncated to keep the page readable
     summary_data = {
-        'stats': summary.get('stats', {
-            'total_processed': 0,
-            'modules_added': 0,
-            'users_added': 0
-        }),
-        'warnings': summary.get('warnings', []),
-        'errors': summary.get('errors', []),
-        'timestamp': timestamp
+        'job_id': job_id,
+        'status': status['status'],
+        'complete': status['complete'],
+        'message': status['message'],
+        'status_url': url_for('admin.moduleuploadjobresource', job_id=job_id),
+        'reapply_url': url_for('admin.moduleuploadreapplyresource', job_id=job_id) if status['can_reapply'] else None,
+        'stats': {
+            'total_processed': progress.get('total_processed', 0),
+            'modules_added': progress.get('modules_added', 0),
+            'users_added': progress.get('users_added', 0),
+            'modules_updated': progress.get('modules_updated'),
+            'modules_unchanged': progress.get('modules_unchanged'),
+            'academic_year': status['academic_year']
+        },
+        'warnings': [w[:200] for w in status['warnings'][:50]],
+        'errors': [e[:200] for e in status['errors'][:50]],
+        'has_more_warnings': progress.get('warnings', 0) > 50,
+        'has_more_errors': progress.get('errors', 0) > 50,
+        'timestamp': status['finished_at'] or status['created_at']
     }
 
-    # Clear the summary from session
-    session.pop('upload_summary', None)
-
     return render_template('admin/upload_summary.html', **summary_data)
 
 
@@ -726,27 +564,27 @@ def convert_rating_to_int(rating):
 
 def get_module_lead_info(module):
     """Helper function to fetch module lead information"""
-    if not module or 'module_lead_id' not in module:
+    if not module or not module.get('module_lead_id'):
         return 'Unknown', ''
 
     try:
-        # Handle ObjectId in dict format
-        if isinstance(module['module_lead_id'], dict):
-            lead_id = module['module_lead_id'].get('$oid')
-        else:
-            lead_id = str(module['module_lead_id'])
-
-        if lead_id:
-            lead_response = make_request('GET', f'/users/{lead_id}')
-            if lead_response.status_code == 200:
-                lead_data = lead_response.json().get('data', {})
-                if lead_data:
-                    return lead_data.get('username', 'Unknown'), lead_data.get('email', '')
+        lead_data = get_user_loader().load(module['module_lead_id'])
+        if lead_data:
+            return lead_data.get('username', 'Unknown'), lead_data.get('email', '')
     except Exception as e:
         print(f"Error fetching module lead: {e}")
     
     return 'Unknown', ''
 
+def get_user_names(user_ids):
+    """Helper function to map user IDs to usernames with a single lookup"""
+    try:
+        users = get_user_loader().load_many(user_ids)
+        return {user_id: user.get('username', 'Unknown') for user_id, user in users.items()}
+    except Exception as e:
+        print(f"Error fetching user names: {e}")
+        return {}
+
 @admin_bp.route("/modules/<module_id>/review", methods=["GET", "POST"])
 @login_required
 @admin_required
@@ -759,59 +597,18 @@ def review_module(module_id):
             return redirect(url_for("admin.view_pending_modules"))
 
         # Get module data
-        response = make_request('GET', f'/modules/{clean_id}')
-        
-        if response.status_code == 200:
-            data = response.json()
-            module = data.get('data') if data.get('success') else None
-            
-            if module:
-                # Add module lead information
-                module['module_lead'], module['module_lead_email'] = get_module_lead_info(module)
-
-                # Get existing review if any
-                review_response = make_request('GET', f'/reviews/module/{clean_id}')
-                if review_response.status_code == 200:
-                    review_data = review_response.json()
-                    if review_data.get('success'):
-                        review = review_data.get('data')
-                        if review and 'edit_history' in review:
-                            # Get editor names for edit history
-                            editor_ids = [str(edit.get('editor_id', {}).get('$oid', '')) 
-                                        for edit in review['edit_history']]
-                            editor_names = {}
-                            
-                            # Fetch all editor names in one request
-                            if editor_ids:
-                                editors_response = make_request('GET', '/users', 
-                                                             params={'ids': editor_ids})
-                                if editors_response.status_code == 200:
-                                    editors_data = editors_response.json()
-                                    if editors_data.get('success'):
-                                        editors = editors_data.get('data', {}).get('items', [])
-                                        editor_names = {
-                                            str(editor.get('_id', {}).get('$oid', '')): 
-                                            editor.get('username', 'Unknown')
-                                            for editor in editors
-                                        }
-                            
-                            # Add editor names to edit history
-                            for edit in review['edit_history']:
-                                editor_id = str(edit.get('editor_id', {}).get('$oid', ''))
-                                edit['editor_name'] = editor_names.get(editor_id, 'Unknown')
-
-        else:
-            module = None
-
+        module = modules_service.get_module(clean_id)
         if not module:
             flash("Module not found", "danger")
             return redirect(url_for("admin.view_pending_modules"))
 
+        # Add module lead information
+        module['module_lead'], module['module_lead_email'] = get_module_lead_info(module)
+
         if request.method == "POST" and form.validate_on_submit():  # Add CSRF validation
             review_data = {
                 "module_id": clean_id,
                 "reviewer_id": str(current_user.id),
-                "review_date": str(datetime.utcnow()),
                 "enhancement_plan_update": request.form.get("enhancementPlan"),
                 "student_attainment": request.form.get("studentAttainment"),
                 "student_feedback": request.form.get("studentFeedback"),
@@ -836,13 +633,12 @@ def review_module(module_id):
 
             print("Submitting review data:", review_data)  # Debug print
 
-            res = make_request('POST', '/reviews', json=review_data)
-            if res.status_code == 201:
+            try:
+                reviews_service.create_review(**review_data)
                 flash("Module review submitted successfully", "success")
                 return redirect(url_for("admin.view_module", module_id=clean_id))  # Updated redirect target
-            else:
-                error_data = res.json()
-                flash(error_data.get('message', 'Error submitting review'), "danger")
+            except Exception as e:
+                flash(str(e) or 'Error submitting review', "danger")
 
         return render_template(
             "admin/review_module.html", 
@@ -863,7 +659,9 @@ def format_date(date_value):
         return None
         
     try:
-        if isinstance(date_value, dict) and '$date' in date_value:
+        if isinstance(date_value, datetime):
+            return date_value
+        elif isinstance(date_value, dict) and '$date' in date_value:
             # Handle MongoDB ISODate format
             date_str = date_value['$date']
             if '.' in date_str:  # Handle milliseconds
@@ -891,46 +689,29 @@ def view_module(module_id):
             return redirect(url_for('admin.view_modules'))
 
         # Get module data
-        response = make_request('GET', f'/modules/{clean_id}')
-        print(f"Module API Response: {response.status_code}, {response.text}")
-
-        if response.status_code != 200:
-            flash("Error loading module", "danger")
-            return redirect(url_for('admin.view_modules'))
-
-        result = response.json()
-        if not result.get('success'):
+        module = modules_service.get_module(clean_id)
+        if not module:
             flash("Failed to load module data", "danger")
             return redirect(url_for('admin.view_modules'))
 
-        module = result.get('data')
-        if not isinstance(module, dict):
-            flash("Invalid module data format", "danger")
-            return redirect(url_for('admin.view_modules'))
-
-        if module:
-            # Add module lead information
-            module['module_lead'], module['module_lead_email'] = get_module_lead_info(module)
-
-        # Format dates in module
-        if isinstance(module.get('review_date'), dict):
-            module['review_date'] = format_date(module['review_date'])
-
         # Get review data
         review_data = None
         if module.get('review_submitted'):
-            review_response = make_request('GET', f'/reviews/module/{clean_id}')
-            if review_response.status_code == 200:
-                review_result = review_response.json()
-                if review_result.get('success'):
-                    review_data = review_result.get('data')
-                    
-                    # Format dates in enhancement plans
-                    if isinstance(review_data, dict):
-                        review_data['review_date'] = format_date(review_data.get('review_date'))
-                        for plan in review_data.get('enhancement_plans', []):
-                            if isinstance(plan.get('added_date'), dict):
-                                plan['added_date'] = format_date(plan['added_date'])
+            review_data = reviews_service.get_review_for_module(clean_id)
+            if review_data:
+                review_data['review_date'] = format_date(review_data.get('review_date'))
+                for plan in review_data.get('enhancement_plans', []):
+                    plan['added_date'] = format_date(plan.get('added_date'))
+
+        # Fetch the lead, reviewer and editors together with one query
+        user_ids = [module.get('module_lead_id')]
+        if review_data:
+            user_ids.append(review_data.get('reviewer_id'))
+            user_ids.extend(edit.get('editor_id') for edit in review_data.get('edit_history', []))
+        get_user_loader().prime(user_ids)
+
+        # Add module lead information
+        module['module_lead'], module['module_lead_email'] = get_module_lead_info(module)
 
         # When fetching review data, add editor information
         if review_data and 'edit_history' in review_data:
@@ -959,17 +740,9 @@ def get_reviewer_name(reviewer_id):
         return "Unknown"
         
     try:
-        if isinstance(reviewer_id, dict):
-            reviewer_id = reviewer_id.get('$oid')
-        
-        if not reviewer_id:
-            return "Unknown"
-            
-        response = make_request('GET', f'/users/{reviewer_id}')
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('success') and result.get('data'):
-                return result['data'].get('username', 'Unknown')
+        reviewer = get_user_loader().load(reviewer_id)
+        if reviewer:
+            return reviewer.get('username', 'Unknown')
     except Exception as e:
         print(f"Error getting reviewer name: {e}")
     
@@ -988,37 +761,13 @@ def edit_review(module_id):
             return redirect(url_for("admin.view_completed_modules"))
 
         # Get module data
-        module_response = make_request('GET', f'/modules/{clean_id}')
-        print(f"Module API Response: {module_response.status_code}")  # Debug log
-        
-        if module_response.status_code != 200:
-            flash("Error loading module data", "danger")
-            return redirect(url_for("admin.view_completed_modules"))
-
-        module_data = module_response.json()
-        if not module_data.get('success'):
-            flash(module_data.get('message', 'Failed to load module'), "danger")
-            return redirect(url_for("admin.view_completed_modules"))
-
-        module = module_data.get('data')
+        module = modules_service.get_module(clean_id)
         if not module:
             flash("Module not found", "danger")
             return redirect(url_for("admin.view_completed_modules"))
 
         # Get review data
-        review_response = make_request('GET', f'/reviews/module/{clean_id}')
-        print(f"Review API Response: {review_response.status_code}")  # Debug log
-
-        if review_response.status_code != 200:
-            flash("Review data not accessible", "danger")
-            return redirect(url_for("admin.view_module", module_id=clean_id))
-
-        review_data = review_response.json()
-        if not review_data.get('success'):
-            flash(review_data.get('message', 'Failed to load review'), "danger")
-            return redirect(url_for("admin.view_module", module_id=clean_id))
-
-        review = review_data.get('data')
+        review = reviews_service.get_review_for_module(clean_id)
         if not review:
             flash("Review not found", "danger")
             return redirect(url_for("admin.view_module", module_id=clean_id))
@@ -1027,9 +776,7 @@ def edit_review(module_id):
         if request.method == "POST" and form.validate_on_submit():
             try:
                 # Get the review ID
-                review_id = str(review.get('_id', {}).get('$oid'))
-                if not review_id:
-                    raise ValueError("Invalid review ID")
+                review_id = str(review['_id'])
 
                 # Collect enhancement plans
                 enhancement_plans = []
@@ -1043,42 +790,22 @@ def edit_review(module_id):
                     i += 1
 
                 # Prepare update data with correct structure
-                updated_review = {
-                    "editor_id": str(current_user.id),
-                    "data": {
-                        "reviewer_id": str(current_user.id),
-                        "review_date": str(datetime.utcnow()),
-                        "enhancement_plan": request.form.get("enhancementPlan"),
-                        "student_attainment": request.form.get("studentAttainment"),
-                        "student_feedback": request.form.get("studentFeedback"),
-                        "risks": request.form.get("risks"),
-                        "engagement_rating": convert_rating_to_int(request.form.get("engagement")),
-                        "learning_environment_rating": convert_rating_to_int(request.form.get("learningEnvironment")),
-                        "timetabling_rating": convert_rating_to_int(request.form.get("timetabling")),
-                        "enhancement_plans": enhancement_plans
-                    }
+                update_data = {
+                    "reviewer_id": str(current_user.id),
+                    "review_date": datetime.utcnow(),
+                    "enhancement_plan": request.form.get("enhancementPlan"),
+                    "student_attainment": request.form.get("studentAttainment"),
+                    "student_feedback": request.form.get("studentFeedback"),
+                    "risks": request.form.get("risks"),
+                    "engagement_rating": convert_rating_to_int(request.form.get("engagement")),
+                    "learning_environment_rating": convert_rating_to_int(request.form.get("learningEnvironment")),
+                    "timetabling_rating": convert_rating_to_int(request.form.get("timetabling")),
+                    "enhancement_plans": enhancement_plans
                 }
 
-                print(f"Sending update request for review {review_id}:")
-                print(f"Data: {updated_review}")
-
-                # Make API request
-                update_response = make_request('PUT', f'/reviews/{review_id}', json=updated_review)
-                print(f"Update response: {update_response.status_code}")
-                print(f"Response content: {update_response.text}")
-
-                if update_response.status_code == 200:
-                    flash("Review updated successfully", "success")
-                    return redirect(url_for("admin.view_module", module_id=clean_id))
-
-                error_message = "Unknown error occurred"
-                try:
-                    error_data = update_response.json()
-                    error_message = error_data.get('message', 'Server error occurred')
-                except:
-                    error_message = f"Server error: {update_response.status_code}"
-                
-                raise ValueError(error_message)
+                reviews_service.update_review(review_id, str(current_user.id), update_data)
+                flash("Review updated successfully", "success")
+                return redirect(url_for("admin.view_module", module_id=clean_id))
 
             except Exception as e:
                 print(f"Error updating review: {str(e)}")
@@ -1105,18 +832,9 @@ def get_editor_names(edit_history):
     if not edit_history:
         return editor_names
         
-    try:
-        editor_ids = [str(edit['editor_id']) for edit in edit_history if 'editor_id' in edit]
-        if editor_ids:
-            response = make_request('GET', '/users', params={'ids': editor_ids, 'per_page': 0})
-            if response.status_code == 200:
-                users = response.json().get('data', {}).get('items', [])
-                editor_names = {
-                    str(user['_id']): user.get('username', 'Unknown')
-                    for user in users
-                }
-    except Exception as e:
-        print(f"Error fetching editor names: {e}")
+    editor_ids = [edit['editor_id'] for edit in edit_history if 'editor_id' in edit]
+    if editor_ids:
+        editor_names = get_user_names(editor_ids)
     
     return editor_names
 
@@ -1132,35 +850,20 @@ def edit_module(module_id):
             return redirect(url_for('admin.view_modules'))
 
         # Get module data
-        response = make_request('GET', f'/modules/{clean_id}')
-        
-        if not response.ok:
-            logger.error(f"Error fetching module {clean_id}: {response.status_code}, {response.text}")
-            flash("Error loading module", "danger")
-            return redirect(url_for('admin.view_modules'))
-
-        module_data = response.json()
-        if not module_data.get('success'):
-            flash(module_data.get('message', 'Failed to load module'), "danger")
-            return redirect(url_for('admin.view_modules'))
-
-        module = module_data.get('data')
-
-        # Fetch all module leads using the API with a large per_page value
-        leads_response = make_request('GET', '/users', params={
-            'role': 'module_lead',
-            'is_active': True,
-            'sort': 'username',
-            'direction': 'asc',
-            'per_page': 0 
-        })
-
-        if not leads_response.ok:
-            flash("Error loading module leads", "danger")
+        module = modules_service.get_module(clean_id)
+        if not module:
+            logger.error(f"Error fetching module {clean_id}: not found")
+            flash("Failed to load module", "danger")
             return redirect(url_for('admin.view_modules'))
 
-        leads_data = leads_response.json()
-        module_leads = leads_data.get('data', {}).get('items', [])
+        # Fetch all active module leads
+        module_leads = users_service.list_users(
+            role='module_lead',
+            is_active=True,
+            sort_field='username',
+            sort_direction=1,
+            per_page=0
+        )['items']
 
         if request.method == "POST":
             module_lead_id = request.form.get('module_lead_id')
@@ -1169,10 +872,7 @@ def edit_module(module_id):
                 return render_template("admin/edit_module.html", module=module, module_leads=module_leads)
 
             # Clean module_lead_id if in MongoDB format
-            if isinstance(module_lead_id, dict) and '$oid' in module_lead_id:
-                module_lead_id = str(module_lead_id['$oid'])
-            elif isinstance(module_lead_id, str):
-                module_lead_id = module_lead_id.replace('{"$oid": "', '').replace('"}', '')
+            module_lead_id = module_lead_id.replace('{"$oid": "', '').replace('"}', '')
 
             update_data = {
                 "module_code": request.form.get('module_code'),
@@ -1183,14 +883,9 @@ def edit_module(module_id):
             }
 
             try:
-                update_response = make_request('PUT', f'/modules/{clean_id}', json=update_data)
-                response_data = update_response.json()
-
-                if update_response.ok and response_data.get('success'):
-                    flash("Module Updated Successfully", "success")
-                    return redirect(url_for('admin.view_modules'))
-                else:
-                    flash(response_data.get('message', 'Failed to update module'), "danger")
+                modules_service.update_module(clean_id, update_data)
+                flash("Module Updated Successfully", "success")
+                return redirect(url_for('admin.view_modules'))
 
             except Exception as e:
                 logger.error(f"Exception during module update: {str(e)}")
@@ -1259,73 +954,113 @@ def send_reminder():
 @login_required
 @admin_required
 def export_pending_modules():
-    """Export pending modules to an Excel file."""
+    """Export modules matching the pending modules page filters to an Excel or CSV file."""
+    export_format = request.args.get("format", "xlsx")
+    if export_format not in exports.EXPORT_FORMATS:
+        flash(f"Unsupported export format: {export_format}", "danger")
+        return redirect(url_for('admin.view_pending_modules'))
+
+    review_status = request.args.get("status", "pending")
+    if review_status not in ("pending", "reviewed"):
+        review_status = None
+
     try:
         current_academic_year = get_academic_year()
-        response = make_request('GET', '/modules', params={
-            "review_submitted": False,  
+        filters = {
+            "search": request.args.get("search", ""),
+            "review_status": review_status,
             "academic_year": current_academic_year,
-            "per_page": 1000
-        })
+            "code_prefix": request.args.get("code_prefix", "").strip().upper() or None
+        }
+        modules = modules_service.iter_modules(
+            **filters,
+            sort_field=request.args.get("sort", "module_code"),
+            sort_direction=-1 if request.args.get("direction", "asc") == "desc" else 1
+        )
 
-        if response.status_code != 200:
-            flash("Error fetching pending modules for export", "danger")
-            return redirect(url_for('admin.view_pending_modules'))
+        label = {"pending": "Pending Modules", "reviewed": "Reviewed Modules"}.get(review_status, "Modules")
+        export_info = [
+            f"{label} Export",
+            f"Academic Year: {current_academic_year} - {int(current_academic_year) + 1}",
+            f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            f"Total {label}: {modules_service.count_matching_modules(**filters)}"
+        ]
 
-        data = response.json().get('data', {})
-        modules = data.get('items', [])
-        
-        modules = [m for m in modules if not m.get("review_submitted", False)]
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        filename = f"{label.replace(' ', '_')}_{timestamp}.{export_format}"
 
-        rows = []
-        for module in modules:
-            rows.append({
-                "Academic Year": f"{module.get('academic_year')} - {int(module.get('academic_year')) + 1}" if module.get('academic_year') else "N/A",
-                "Module Code": module.get("module_code", ""),
-                "Module Name": module.get("module_name", ""),
-                "Module Lead": module.get("module_lead") or "Not Assigned",
-                "Level": module.get("level") or "N/A",
-                "Email ID": module.get("module_lead_email") or "N/A",
-                "Review Status": "Pending" 
-            })
+        if export_format == "csv":
+            return Response(
+                stream_with_context(exports.stream_csv([(exports.MODULE_COLUMNS, modules, export_info)])),
+                mimetype=exports.CSV_MIME_TYPE,
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            )
+
+        output = exports.build_xlsx([(label, exports.MODULE_COLUMNS, modules, export_info)])
+        return send_file(
+            output,
+            mimetype=exports.XLSX_MIME_TYPE,
+            as_attachment=True,
+            download_name=filename
+        )
+
+    except Exception as e:
+        flash(f"Error exporting modules: {str(e)}", "danger")
+        return redirect(url_for('admin.view_pending_modules'))
 
-        df = pd.DataFrame(rows)
+@admin_bp.route("/reviews/export", methods=["GET"])
+@login_required
+@admin_required
+def export_reviews():
+    """Export the reviews of an academic year, with their enhancement plans, to an Excel or CSV file."""
+    export_format = request.args.get("format", "xlsx")
+    if export_format not in exports.EXPORT_FORMATS:
+        flash(f"Unsupported export format: {export_format}", "danger")
+        return redirect(url_for('admin.view_completed_modules'))
 
-        # Add a title with export information
+    try:
+        academic_year = request.args.get("academic_year", type=int) or get_academic_year()
+        filters = {
+            "search": request.args.get("search", ""),
+            "code_prefix": request.args.get("code_prefix", "").strip().upper() or None
+        }
+        total_reviews = reviews_service.count_reviews(academic_year, **filters)
         export_info = [
-            ["Pending Modules Export"],
-            [f"Academic Year: {current_academic_year} - {int(current_academic_year) + 1}"],
-            [f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}"],
-            [f"Total Pending Modules: {len(rows)}"],
-            [""]  # Empty row before the data
+            "Module Reviews Export",
+            f"Academic Year: {academic_year} - {academic_year + 1}",
+            f"Export Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            f"Total Reviews: {total_reviews}"
+        ]
+        sections = [
+            ("Reviews", exports.REVIEW_COLUMNS, reviews_service.iter_reviews(academic_year, **filters), export_info),
+            (
+                "Enhancement Plans",
+                exports.ENHANCEMENT_PLAN_COLUMNS,
+                reviews_service.iter_enhancement_plans(academic_year, **filters),
+                ["Enhancement Plans"]
+            )
         ]
-        info_df = pd.DataFrame(export_info)
-
-        # Combine into a single Excel file
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Write the info section
-            info_df.to_excel(writer, index=False, header=False, sheet_name="Pending Modules")
-            
-            # Write the data section starting a few rows down
-            df.to_excel(writer, index=False, sheet_name="Pending Modules", startrow=len(export_info))
-            
-            worksheet = writer.sheets["Pending Modules"]
-            for i, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(i, i, max_len)
 
-        output.seek(0)
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        filename = f"Pending_Modules_{timestamp}.xlsx"
+        filename = f"Module_Reviews_{academic_year}_{timestamp}.{export_format}"
+
+        if export_format == "csv":
+            return Response(
+                stream_with_context(exports.stream_csv(
+                    (columns, documents, title_lines) for _, columns, documents, title_lines in sections
+                )),
+                mimetype=exports.CSV_MIME_TYPE,
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            )
 
+        output = exports.build_xlsx(sections)
         return send_file(
             output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            mimetype=exports.XLSX_MIME_TYPE,
             as_attachment=True,
             download_name=filename
         )
 
     except Exception as e:
-        flash(f"Error exporting pending modules: {str(e)}", "danger")
-        return redirect(url_for('admin.view_pending_modules'))
\ No newline at end of file
+        flash(f"Error exporting reviews: {str(e)}", "danger")
+        return redirect(url_for('admin.view_completed_modules'))
@@ -1,13 +1,14 @@
 from bson.objectid import ObjectId
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from extensions import mongo
+from services import counters
+from services import passwords
 
 class User(UserMixin):
     def __init__(self, user_data):
         self.id = str(user_data.get("_id"))
         self.username = user_data["username"]
-        self.password = user_data["password"]
+        self.password = user_data.get("password")
         self.email = user_data["email"]
         self._is_active = user_data.get("is_active", True)
         self.role = user_data.get("role", "module_lead")
@@ -43,18 +44,19 @@ class User(UserMixin):
         if not admin_user:
             mongo.db.users.insert_one({
                 "username": "Admin User",
-                "password": generate_password_hash("admin123"),
+                "password": passwords.hash_password("admin123"),
                 "email": "admin@ames.edu.eu",
                 "is_active": True,
                 "role": "admin"
             })
+            counters.record_users_added(["admin"])
 
     @staticmethod
     def create_user(user_data):
         return mongo.db.users.insert_one(user_data)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return passwords.check_password(self.password, password)
 
     def get_id(self):
         return self.id
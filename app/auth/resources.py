@@ -2,7 +2,9 @@ from flask_restful import Resource, reqparse
 from flask import jsonify, request, url_for, redirect
 from flask_login import login_user, logout_user, current_user, login_required
 from .models import User
-from werkzeug.security import generate_password_hash, check_password_hash
+from services import counters
+from services.passwords import hash_password
+from utils.sessions import regenerate_session
 
 class LoginAPI(Resource):
     def post(self):
@@ -27,6 +29,7 @@ class LoginAPI(Resource):
                 if user.role not in ["admin", "module_lead"]:
                     return {"success": False, "message": "You don't have permission to access this area."}, 403
 
+                regenerate_session()
                 login_user(user, remember=True)  # Flask-Login handles session
                 redirect_url = url_for('admin.dashboard') if user.role == "admin" else url_for('module_lead.dashboard')
 
@@ -71,11 +74,12 @@ class UserAPI(Resource):
             user_data = {
                 'username': args['username'],
                 'email': args['email'],
-                'password': generate_password_hash(args['password']),
+                'password': hash_password(args['password']),
                 'role': args['role'],
                 'is_active': True
             }
             result = User.create_user(user_data)
+            counters.record_users_added([user_data['role']])
             return {'message': 'User created successfully', 'user_id': str(result.inserted_id)}, 201
         except Exception as e:
             return {'message': 'Error creating user', 'error': str(e)}, 500
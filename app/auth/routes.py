@@ -2,7 +2,8 @@ from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from extensions import mongo, login_manager
 from .models import User
-from .forms import LoginForm
+from .forms import LoginForm, ActivationForm
+from services import users as users_service
 from bson.objectid import ObjectId
 from . import auth_bp
 
@@ -36,3 +37,22 @@ def logout():
     logout_user()
     flash("You have been logged out.", "info")
     return response
+
+@auth_bp.route("/activate/<token>", methods=["GET", "POST"])
+def activate(token):
+    form = ActivationForm()
+    if form.validate_on_submit():
+        try:
+            user = users_service.activate_user(token, form.password.data)
+        except ValueError as e:
+            flash(str(e), "danger")
+            return render_template("auth/activate.html", form=form)
+
+        if not user:
+            flash("This activation link is invalid or has expired. Please contact the administrator.", "danger")
+            return redirect(url_for("auth.login"))
+
+        flash("Your account is active. You can now log in.", "success")
+        return redirect(url_for("auth.login"))
+
+    return render_template("auth/activate.html", form=form)
@@ -6,9 +6,6 @@ load_dotenv()
 class Config:
     # Flask Settings
     SECRET_KEY = os.getenv("SECRET_KEY", "default_secret_key")
-    
-    # API Settings
-    API_BASE_URL = 'http://127.0.0.1:5000/api'
 
     # Mail Settings
     MAIL_SERVER = os.getenv("MAIL_SERVER", 'localhost')
@@ -18,7 +15,38 @@ class Config:
     MAIL_USERNAME = os.getenv("MAIL_USERNAME", None)
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", None)
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", 'no-reply@localhost')
+
+    # Email Outbox Settings
+    EMAIL_OUTBOX_WORKERS = int(os.getenv("EMAIL_OUTBOX_WORKERS", 2))
+    EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", 2))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 5))
+    EMAIL_RETRY_DELAY = int(os.getenv("EMAIL_RETRY_DELAY", 30))
+    EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", 300))
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 50))
+    EMAIL_TEMPLATE_CACHE_DIR = os.getenv("EMAIL_TEMPLATE_CACHE_DIR")
     SYSTEM_URL = os.getenv("SYSTEM_URL", 'http://localhost:5000')
+
+    # API Settings
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+    # Upload Settings
+    UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_SIZE", 50 * 1024 * 1024))  # 0 removes the limit
+    # Requests are refused before anything is spooled once they pass the upload limit plus room for the form
+    MAX_CONTENT_LENGTH = UPLOAD_MAX_FILE_SIZE + 1024 * 1024 if UPLOAD_MAX_FILE_SIZE else None
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 1))
+    UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", 2))
+    UPLOAD_LEASE_SECONDS = int(os.getenv("UPLOAD_LEASE_SECONDS", 600))
+    UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 3))
+    UPLOAD_JOB_DIR = os.getenv("UPLOAD_JOB_DIR")
+    # "password" gives new module leads a default password, "activation" emails them a one-time link instead
+    UPLOAD_ACCOUNT_SETUP = os.getenv("UPLOAD_ACCOUNT_SETUP", "password")
+
+    # Password Settings
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))  # 0 hashes in-thread
+    ACTIVATION_TOKEN_TTL = int(os.getenv("ACTIVATION_TOKEN_TTL", 7 * 24 * 3600))
+
+    # Snapshot Settings
+    SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")  # Defaults to snapshots/ in the instance folder
     
 class DevelopmentConfig(Config):
     # Flask Settings
@@ -27,11 +55,16 @@ class DevelopmentConfig(Config):
     
     # Database Settings
     MONGO_URI = os.getenv("MONGO_URI")
+    MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
 
     # Session Settings
     SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
     SESSION_COOKIE_HTTPONLY= os.getenv("SESSION_COOKIE_HTTPONLY", "true").lower() == "true"
     SESSION_COOKIE_SAMESITE= os.getenv("SESSION_COOKIE_SAMESITE", 'Lax')
+    # "mongo" keeps session data server-side and only an opaque ID in the cookie; "cookie" signs it all into the cookie
+    SESSION_STORE = os.getenv("SESSION_STORE", "mongo")
+    SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1024))
+    SESSION_CACHE_SECONDS = int(os.getenv("SESSION_CACHE_SECONDS", 60))  # 0 reads every session from MongoDB
 
 config = {
     "development": DevelopmentConfig,
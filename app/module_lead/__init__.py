@@ -1,9 +1,11 @@
 from flask import Blueprint, g
 from flask_restful import Api
 from flask_login import current_user
+from utils.serialization import output_json
 
 module_lead_bp = Blueprint('module_lead', __name__, url_prefix='/module-lead')  
 api = Api(module_lead_bp) 
+api.representations['application/json'] = output_json
 
 @module_lead_bp.before_request
 def before_request():
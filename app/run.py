@@ -1,4 +1,6 @@
-from flask import Flask, render_template
+import click
+import time
+from flask import Flask, render_template, jsonify
 from config import config
 from extensions import mongo, login_manager, jwt, moment, cors, mail
 from auth import init_auth
@@ -7,12 +9,24 @@ from module_lead import init_module_lead
 from base.routes import base_bp
 from auth.models import User
 from base.utils import get_academic_year
+from services.indexes import ensure_indexes, index_drift, has_drift
+from services.counters import rebuild_all
+from services.search import backfill_search_keys, reindex_modules
+from services.outbox import init_outbox_workers, process_batch
+from services.upload_jobs import init_upload_workers, process_next, prune_archive
 from datetime import datetime
+from utils.serialization import MongoJSONProvider
+from utils.email import init_email_templates
+from utils.spooling import SpoolingRequest
+from utils.sessions import init_session_store
 
 def create_app():
     """Application factory function"""
     app = Flask(__name__)
+    app.request_class = SpoolingRequest
     app.config.from_object(config['development'])
+    app.json = MongoJSONProvider(app)
+    init_session_store(app)
     
     # Initialize extensions
     init_extensions(app)
@@ -25,6 +39,14 @@ def create_app():
     
     # Register template filters and globals
     register_template_utilities(app)
+
+    # Register CLI commands
+    register_commands(app)
+
+    # Compile email templates once, then deliver queued emails and process uploads in the background
+    init_email_templates(app)
+    init_outbox_workers(app)
+    init_upload_workers(app)
     
     return app
 
@@ -58,6 +80,11 @@ def register_error_handlers(app):
     def not_found_error(error):
         return render_template('errors/404.html'), 404
 
+    @app.errorhandler(413)
+    def request_too_large(error):
+        limit = app.config["UPLOAD_MAX_FILE_SIZE"] // (1024 * 1024)
+        return jsonify({"success": False, "message": f"File size exceeds {limit}MB limit"}), 413
+
     @app.errorhandler(500)
     def internal_error(error):
         return render_template('errors/500.html'), 500
@@ -65,6 +92,8 @@ def register_error_handlers(app):
 def register_template_utilities(app):
     """Register template filters and global variables"""
     def format_datetime(value):
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M UTC')
         if isinstance(value, dict) and '$date' in value:
             try:
                 dt = datetime.strptime(value['$date'], '%Y-%m-%dT%H:%M:%S.%fZ')
@@ -83,10 +112,127 @@ def register_template_utilities(app):
         min=min
     )
 
+def register_commands(app):
+    """Register Flask CLI commands"""
+    def echo_drift(report):
+        for collection_name, status in report.items():
+            for state in ("missing", "changed", "unmanaged"):
+                for name in status[state]:
+                    click.echo(f"{collection_name}.{name}: {state}")
+
+    @app.cli.group()
+    def indexes():
+        """Manage MongoDB indexes"""
+
+    @indexes.command("check")
+    def check_indexes():
+        """Report drift between the index registry and the database"""
+        report = index_drift()
+        echo_drift(report)
+        if has_drift(report):
+            raise SystemExit(1)
+        click.echo("Indexes are in sync")
+
+    @indexes.command("sync")
+    @click.option("--drop-changed", is_flag=True, help="Rebuild indexes whose definition has changed")
+    def sync_indexes(drop_changed):
+        """Create missing indexes from the registry"""
+        report = ensure_indexes(drop_changed=drop_changed)
+        echo_drift(report)
+        if has_drift(report):
+            raise SystemExit(1)
+        click.echo("Indexes are in sync")
+
+    @app.cli.group()
+    def counters():
+        """Manage dashboard counters"""
+
+    @counters.command("rebuild")
+    def rebuild_counters():
+        """Recount the dashboard counters from the modules and users collections"""
+        rebuild_all()
+        click.echo("Counters rebuilt")
+
+    @app.cli.group()
+    def search():
+        """Manage module search keys"""
+
+    @search.command("reindex")
+    def reindex_search():
+        """Recompute the search keys of every module"""
+        click.echo(f"Updated search keys for {reindex_modules()} modules")
+
+    @app.cli.group()
+    def outbox():
+        """Manage the email outbox"""
+
+    @outbox.command("work")
+    @click.option("--once", is_flag=True, help="Exit when no message is due instead of polling")
+    def work_outbox(once):
+        """Deliver queued emails in the foreground"""
+        while True:
+            stats = process_batch()
+            if stats["sent"] or stats["failed"]:
+                click.echo(
+                    f"Sent {stats['sent']}, failed {stats['failed']}, "
+                    f"{stats['connections']} connection(s), {stats['messages_per_second']} msg/s"
+                )
+            elif once:
+                break
+            else:
+                time.sleep(app.config["EMAIL_POLL_INTERVAL"])
+
+    @app.cli.group()
+    def uploads():
+        """Manage module upload jobs"""
+
+    @uploads.command("work")
+    @click.option("--once", is_flag=True, help="Exit when no job is queued instead of polling")
+    def work_uploads(once):
+        """Process queued upload jobs in the foreground"""
+        while True:
+            if process_next():
+                click.echo("Processed an upload job")
+            elif once:
+                break
+            else:
+                time.sleep(app.config["UPLOAD_POLL_INTERVAL"])
+
+    @uploads.command("prune")
+    def prune_uploads():
+        """Delete archived upload files that no remaining job refers to"""
+        click.echo(f"Deleted {prune_archive()} archived upload files")
+
+    @app.cli.group()
+    def snapshots():
+        """Manage Parquet snapshots of modules and reviews"""
+
+    @snapshots.command("refresh")
+    @click.option("--year", type=int, help="Academic year to snapshot, the current one by default")
+    @click.option("--full", is_flag=True, help="Rewrite every review instead of only those changed since the last refresh")
+    def refresh_snapshots(year, full):
+        """Write the modules and reviews of an academic year to Parquet files"""
+        # pyarrow is only needed here, so the app does not load it on every start
+        from services.snapshots import refresh_snapshot
+
+        if year is None:
+            # Outside a request the session is empty, so this is the academic year by date
+            with app.test_request_context():
+                year = get_academic_year()
+        manifest = refresh_snapshot(year, full=full)
+        counts = manifest["counts"]
+        click.echo(
+            f"Wrote {counts['modules']} modules, {counts['reviews']} reviews and "
+            f"{counts['enhancement_plans']} enhancement plans ({counts['reviews_read']} reviews read)"
+        )
+
 def initialize_database(app):
     """Initialize database with required data"""
     with app.app_context():
         User.create_admin()
+        if app.config.get("MONGO_ENSURE_INDEXES"):
+            ensure_indexes()
+        backfill_search_keys()
 
 # Application initialization
 app = create_app()
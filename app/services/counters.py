@@ -0,0 +1,172 @@
+from collections import defaultdict
+from datetime import datetime
+from extensions import mongo
+
+# Counters documents are keyed by "modules:<academic_year>" and "users"
+USER_COUNTERS_ID = "users"
+
+
+def _collection():
+    return mongo.db.dashboard_counters
+
+
+def _module_counters_id(academic_year):
+    return f"modules:{int(academic_year)}"
+
+
+def rebuild_module_counters(academic_year):
+    """Recount a year's modules with one aggregation and store the counters document"""
+    pipeline = [
+        {"$match": {"academic_year": int(academic_year)}},
+        {
+            "$group": {
+                "_id": "$module_lead_id",
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": ["$review_submitted", 1, 0]}}
+            }
+        }
+    ]
+
+    counters = {"total": 0, "completed": 0, "leads": {}}
+    for group in mongo.db.modules.aggregate(pipeline):
+        counters["total"] += group["total"]
+        counters["completed"] += group["completed"]
+        if group["_id"]:
+            counters["leads"][str(group["_id"])] = {
+                "total": group["total"],
+                "completed": group["completed"]
+            }
+
+    counters["updated_at"] = datetime.utcnow()
+    _collection().replace_one({"_id": _module_counters_id(academic_year)}, counters, upsert=True)
+    return counters
+
+
+def rebuild_user_counters():
+    """Recount users by role with one aggregation and store the counters document"""
+    counters = {"total": 0, "roles": {}}
+    for group in mongo.db.users.aggregate([{"$group": {"_id": "$role", "count": {"$sum": 1}}}]):
+        counters["total"] += group["count"]
+        if group["_id"]:
+            counters["roles"][group["_id"]] = group["count"]
+
+    counters["updated_at"] = datetime.utcnow()
+    _collection().replace_one({"_id": USER_COUNTERS_ID}, counters, upsert=True)
+    return counters
+
+
+def _module_counts(counters):
+    total = counters.get("total", 0)
+    completed = counters.get("completed", 0)
+    return {"total": total, "pending": total - completed, "completed": completed}
+
+
+def _user_counts(counters):
+    roles = counters.get("roles", {})
+    return {
+        "total": counters.get("total", 0),
+        "admin": roles.get("admin", 0),
+        "module_lead": roles.get("module_lead", 0)
+    }
+
+
+def get_dashboard_counts(academic_year, module_lead_id=None):
+    """Get module counts for a year, optionally for one lead, and user counts
+
+    Both counters documents are read with a single query on _id. A missing
+    document is rebuilt from the source collections the first time it is needed.
+    """
+    module_counters_id = _module_counters_id(academic_year)
+    documents = {
+        doc["_id"]: doc
+        for doc in _collection().find({"_id": {"$in": [module_counters_id, USER_COUNTERS_ID]}})
+    }
+
+    module_counters = documents.get(module_counters_id) or rebuild_module_counters(academic_year)
+    user_counters = documents.get(USER_COUNTERS_ID) or rebuild_user_counters()
+
+    counts = {
+        "modules": _module_counts(module_counters),
+        "users": _user_counts(user_counters)
+    }
+    if module_lead_id is not None:
+        lead_counters = module_counters.get("leads", {}).get(str(module_lead_id), {})
+        counts["lead_modules"] = _module_counts(lead_counters)
+
+    return counts
+
+
+def _increment(counters_id, increments):
+    # Only existing documents are incremented; missing ones are rebuilt on read
+    increments = {field: value for field, value in increments.items() if value}
+    if increments:
+        _collection().update_one(
+            {"_id": counters_id},
+            {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
+
+def record_modules_added(modules):
+    """Count newly inserted modules"""
+    increments = defaultdict(lambda: defaultdict(int))
+    for module in modules:
+        fields = increments[_module_counters_id(module["academic_year"])]
+        completed = 1 if module.get("review_submitted") else 0
+        fields["total"] += 1
+        fields["completed"] += completed
+        if module.get("module_lead_id"):
+            lead_key = f"leads.{module['module_lead_id']}"
+            fields[f"{lead_key}.total"] += 1
+            fields[f"{lead_key}.completed"] += completed
+
+    for counters_id, fields in increments.items():
+        _increment(counters_id, fields)
+
+
+def record_module_reviewed(module):
+    """Count a module whose review has just been submitted"""
+    fields = {"completed": 1}
+    if module.get("module_lead_id"):
+        fields[f"leads.{module['module_lead_id']}.completed"] = 1
+    _increment(_module_counters_id(module["academic_year"]), fields)
+
+
+def record_module_lead_changed(module, new_lead_id):
+    """Move a module's counts from its previous lead to new_lead_id"""
+    old_lead_id = module.get("module_lead_id")
+    if str(old_lead_id) == str(new_lead_id):
+        return
+
+    completed = 1 if module.get("review_submitted") else 0
+    fields = {}
+    if old_lead_id:
+        fields[f"leads.{old_lead_id}.total"] = -1
+        fields[f"leads.{old_lead_id}.completed"] = -completed
+    if new_lead_id:
+        fields[f"leads.{new_lead_id}.total"] = 1
+        fields[f"leads.{new_lead_id}.completed"] = completed
+    _increment(_module_counters_id(module["academic_year"]), fields)
+
+
+def record_users_added(roles):
+    """Count newly inserted users given their roles"""
+    fields = defaultdict(int)
+    for role in roles:
+        fields["total"] += 1
+        fields[f"roles.{role}"] += 1
+    _increment(USER_COUNTERS_ID, fields)
+
+
+def record_user_role_changed(old_role, new_role):
+    """Move a user's count from old_role to new_role"""
+    if old_role == new_role:
+        return
+    _increment(USER_COUNTERS_ID, {f"roles.{old_role}": -1, f"roles.{new_role}": 1})
+
+
+def rebuild_all():
+    """Rebuild the user counters and the counters for every academic year"""
+    for academic_year in mongo.db.modules.distinct("academic_year"):
+        if academic_year is not None:
+            rebuild_module_counters(academic_year)
+    rebuild_user_counters()
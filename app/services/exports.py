@@ -0,0 +1,159 @@
+import csv
+import io
+import tempfile
+import xlsxwriter
+from admin.constants import ENHANCEMENT_PLAN_OPTIONS
+
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME_TYPE = "text/csv"
+EXPORT_FORMATS = ("xlsx", "csv")
+
+# CSV output is flushed to the client in blocks of this many rows
+CSV_BATCH_ROWS = 500
+
+
+class Column:
+    """An export column: its header, a fixed width so no pass over the data is needed, and its value"""
+
+    def __init__(self, header, width, value):
+        self.header = header
+        self.width = width
+        self.value = value
+
+
+def _academic_year(module):
+    year = module.get("academic_year")
+    return f"{year} - {int(year) + 1}" if year else "N/A"
+
+
+# Columns of a module export
+MODULE_COLUMNS = [
+    Column("Academic Year", 15, _academic_year),
+    Column("Module Code", 14, lambda module: module.get("module_code", "")),
+    Column("Module Name", 50, lambda module: module.get("module_name", "")),
+    Column("Module Lead", 25, lambda module: module.get("module_lead") or "Not Assigned"),
+    Column("Level", 8, lambda module: module.get("level") or "N/A"),
+    Column("Email ID", 32, lambda module: module.get("module_lead_email") or "N/A"),
+    Column("Review Status", 15, lambda module: "Completed" if module.get("review_submitted") else "Pending"),
+]
+
+
+def _review_date(review):
+    review_date = review.get("review_date")
+    return review_date.strftime("%Y-%m-%d %H:%M") if review_date else ""
+
+
+def _rating(field):
+    # Ratings are stored as 1 (Strongly Disagree) to 4 (Strongly Agree), 0 when unanswered
+    return lambda review: review.get(field) or ""
+
+
+ENHANCEMENT_PLAN_LABELS = {option["value"]: option["label"] for option in ENHANCEMENT_PLAN_OPTIONS}
+
+# Columns of a review export, one row per review
+REVIEW_COLUMNS = [
+    Column("Academic Year", 15, _academic_year),
+    Column("Module Code", 14, lambda review: review.get("module_code", "")),
+    Column("Module Name", 50, lambda review: review.get("module_name", "")),
+    Column("Module Lead", 25, lambda review: review.get("module_lead") or "Not Assigned"),
+    Column("Reviewer", 25, lambda review: review.get("reviewer") or "Unknown"),
+    Column("Review Date", 17, _review_date),
+    Column("Engagement Rating", 12, _rating("engagement_rating")),
+    Column("Learning Environment Rating", 12, _rating("learning_environment_rating")),
+    Column("Timetabling Rating", 12, _rating("timetabling_rating")),
+    Column("Enhancement Plan Update", 60, lambda review: review.get("enhancement_plan_update") or ""),
+    Column("Student Attainment", 60, lambda review: review.get("student_attainment") or ""),
+    Column("Student Feedback", 60, lambda review: review.get("student_feedback") or ""),
+    Column("Risks", 60, lambda review: review.get("risks") or ""),
+    Column("Enhancement Plans", 12, lambda review: len(review.get("enhancement_plans") or [])),
+]
+
+# Columns of the enhancement plans part of a review export, one row per plan
+ENHANCEMENT_PLAN_COLUMNS = [
+    Column("Module Code", 14, lambda plan: plan.get("module_code", "")),
+    Column("Module Name", 50, lambda plan: plan.get("module_name", "")),
+    Column("Plan", 45, lambda plan: ENHANCEMENT_PLAN_LABELS.get(plan.get("plan"), plan.get("plan") or "")),
+    Column("Details", 80, lambda plan: plan.get("details") or ""),
+]
+
+
+def write_xlsx_sheet(workbook, sheet_name, columns, documents, title_lines=()):
+    """Write title lines, a header row and one row per document to a new worksheet
+
+    Rows go out in order, which is all constant_memory mode allows, so only the
+    current row is ever held in memory. Returns the number of data rows written.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    bold = workbook.add_format({"bold": True})
+
+    for index, column in enumerate(columns):
+        worksheet.set_column(index, index, column.width)
+
+    row = 0
+    for line in title_lines:
+        worksheet.write_string(row, 0, line)
+        row += 1
+    if title_lines:
+        row += 1  # Empty row before the data
+
+    for index, column in enumerate(columns):
+        worksheet.write_string(row, index, column.header, bold)
+
+    count = 0
+    for document in documents:
+        row += 1
+        count += 1
+        for index, column in enumerate(columns):
+            worksheet.write(row, index, column.value(document))
+    return count
+
+
+def build_xlsx(sheets):
+    """Build a workbook from (sheet_name, columns, documents, title_lines) tuples into a temporary file
+
+    The file is anonymous, so it disappears once the response has been sent and closed.
+    """
+    output = tempfile.TemporaryFile()
+    # Free text such as review answers must stay text, never become a formula or URL
+    workbook = xlsxwriter.Workbook(
+        output, {"constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False}
+    )
+    for sheet_name, columns, documents, title_lines in sheets:
+        write_xlsx_sheet(workbook, sheet_name, columns, documents, title_lines)
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+def _csv_value(value):
+    # Spreadsheet apps run cells starting with these as formulas, so text is quoted with '
+    if isinstance(value, str) and value.startswith(("=", "+", "-", "@", "\t", "\r")):
+        return f"'{value}"
+    return value
+
+
+def stream_csv(sections):
+    """Yield a CSV export of (columns, documents, title_lines) sections in blocks of CSV_BATCH_ROWS rows
+
+    Sections follow each other, separated by an empty row, and each is read as it is written.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for position, (columns, documents, title_lines) in enumerate(sections):
+        if position:
+            writer.writerow([])
+        for line in title_lines:
+            writer.writerow([line])
+        if title_lines:
+            writer.writerow([])
+        writer.writerow([column.header for column in columns])
+
+        for count, document in enumerate(documents, start=1):
+            writer.writerow([_csv_value(column.value(document)) for column in columns])
+            if count % CSV_BATCH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+    yield buffer.getvalue()
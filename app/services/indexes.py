@@ -0,0 +1,180 @@
+from flask import current_app
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from extensions import mongo
+
+# Index options that are compared when checking for drift
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+# Declarative registry of the secondary indexes each collection should have
+INDEX_REGISTRY = {
+    "users": [
+        {"name": "email_unique", "keys": [("email", ASCENDING)], "unique": True},
+        {"name": "role_is_active", "keys": [("role", ASCENDING), ("is_active", ASCENDING)]},
+        # Keyset pagination on (sort field, _id)
+        {"name": "username_id", "keys": [("username", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "modules": [
+        {
+            "name": "year_status_prefix_code",
+            "keys": [
+                ("academic_year", ASCENDING),
+                ("review_submitted", ASCENDING),
+                ("code_prefix", ASCENDING),
+                ("module_code", ASCENDING),
+            ],
+        },
+        # A module code appears once per academic year; uploads rely on this to reject duplicates
+        {
+            "name": "code_year_unique",
+            "keys": [("module_code", ASCENDING), ("academic_year", ASCENDING)],
+            "unique": True,
+        },
+        {"name": "module_lead_id", "keys": [("module_lead_id", ASCENDING)]},
+        # Module search on the keys maintained by services.search
+        {"name": "year_search_keys", "keys": [("academic_year", ASCENDING), ("search_keys", ASCENDING)]},
+        # Keyset pagination on (sort field, _id) within a year, with and without a status filter
+        {
+            "name": "year_code_id",
+            "keys": [("academic_year", ASCENDING), ("module_code", ASCENDING), ("_id", ASCENDING)],
+        },
+        {
+            "name": "year_status_code_id",
+            "keys": [
+                ("academic_year", ASCENDING),
+                ("review_submitted", ASCENDING),
+                ("module_code", ASCENDING),
+                ("_id", ASCENDING),
+            ],
+        },
+    ],
+    "email_outbox": [
+        # Workers claim due messages and expired leases in next_attempt_at order
+        {"name": "status_next_attempt", "keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)]},
+        {"name": "status_locked_until", "keys": [("status", ASCENDING), ("locked_until", ASCENDING)]},
+        {"name": "batch_id", "keys": [("batch_id", ASCENDING)]},
+        # Delivered messages are kept for 30 days
+        {"name": "sent_at_ttl", "keys": [("sent_at", ASCENDING)], "expireAfterSeconds": 30 * 24 * 3600},
+    ],
+    "email_delivery_runs": [
+        # Run stats are kept for 7 days
+        {"name": "finished_at_ttl", "keys": [("finished_at", ASCENDING)], "expireAfterSeconds": 7 * 24 * 3600},
+    ],
+    "upload_jobs": [
+        # Repeat uploads are answered from the latest completed job for the same content
+        {
+            "name": "sha256_year_mode_finished",
+            "keys": [
+                ("sha256", ASCENDING),
+                ("academic_year", ASCENDING),
+                ("mode", ASCENDING),
+                ("finished_at", ASCENDING),
+            ],
+        },
+        # Workers claim queued jobs oldest first
+        {"name": "status_created_at", "keys": [("status", ASCENDING), ("created_at", ASCENDING)]},
+        # Finished jobs are kept for 90 days so their outcome can be reused and re-applied
+        {"name": "finished_at_ttl", "keys": [("finished_at", ASCENDING)], "expireAfterSeconds": 90 * 24 * 3600},
+    ],
+    "uploads.files": [
+        {"name": "sha256_kind", "keys": [("metadata.sha256", ASCENDING), ("metadata.kind", ASCENDING)]},
+    ],
+    "sessions": [
+        # Sessions are removed once they expire
+        {"name": "expires_at_ttl", "keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "module_reviews": [
+        {"name": "module_id_unique", "keys": [("module_id", ASCENDING)], "unique": True},
+        # Incremental snapshots read reviews submitted or edited since the last refresh
+        {"name": "review_date", "keys": [("review_date", ASCENDING)]},
+        {"name": "edit_history_edit_date", "keys": [("edit_history.edit_date", ASCENDING)]},
+    ],
+}
+
+
+def _normalize_keys(keys):
+    """Normalize an index key list so registry and server definitions compare equal"""
+    return [
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in keys
+    ]
+
+
+def _index_model(spec):
+    options = {option: spec[option] for option in INDEX_OPTIONS if option in spec}
+    return IndexModel(spec["keys"], name=spec["name"], **options)
+
+
+def _is_changed(spec, current):
+    if _normalize_keys(current["key"]) != _normalize_keys(spec["keys"]):
+        return True
+
+    for option in INDEX_OPTIONS:
+        expected = spec.get(option, False if option in ("unique", "sparse") else None)
+        actual = current.get(option, False if option in ("unique", "sparse") else None)
+        if expected != actual:
+            return True
+
+    return False
+
+
+def index_drift():
+    """Compare the registry with the indexes that exist in the database
+
+    Returns a dict keyed by collection name listing the registry indexes that are
+    missing, the ones whose definition differs, and any unmanaged indexes.
+    """
+    report = {}
+    for collection_name, specs in INDEX_REGISTRY.items():
+        existing = mongo.db[collection_name].index_information()
+        existing.pop("_id_", None)
+
+        missing, changed = [], []
+        for spec in specs:
+            current = existing.pop(spec["name"], None)
+            if current is None:
+                missing.append(spec["name"])
+            elif _is_changed(spec, current):
+                changed.append(spec["name"])
+
+        report[collection_name] = {
+            "missing": missing,
+            "changed": changed,
+            "unmanaged": sorted(existing),
+        }
+    return report
+
+
+def has_drift(report):
+    """Check whether a drift report contains missing or changed indexes"""
+    return any(status["missing"] or status["changed"] for status in report.values())
+
+
+def ensure_indexes(drop_changed=False):
+    """Create any missing registry indexes and return the drift that remains
+
+    Indexes whose definition has changed are only rebuilt when drop_changed is set,
+    since dropping an index on a large collection is not something to do implicitly.
+    """
+    drift = index_drift()
+    for collection_name, specs in INDEX_REGISTRY.items():
+        collection = mongo.db[collection_name]
+        status = drift[collection_name]
+
+        for spec in specs:
+            name = spec["name"]
+            if name in status["changed"]:
+                if not drop_changed:
+                    current_app.logger.warning(f"Index {collection_name}.{name} differs from the registry")
+                    continue
+                collection.drop_index(name)
+            elif name not in status["missing"]:
+                continue
+
+            try:
+                collection.create_indexes([_index_model(spec)])
+                current_app.logger.info(f"Created index {collection_name}.{name}")
+            except OperationFailure as e:
+                current_app.logger.error(f"Failed to create index {collection_name}.{name}: {str(e)}")
+
+    return index_drift()
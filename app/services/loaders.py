@@ -0,0 +1,68 @@
+from bson import ObjectId
+from flask import g
+from extensions import mongo
+
+# Only the fields needed to display a user are loaded
+USER_FIELDS = {"username": 1, "email": 1}
+
+
+def _key(user_id):
+    if user_id is None:
+        return None
+    user_id = str(user_id).strip()
+    return user_id if ObjectId.is_valid(user_id) else None
+
+
+class UserLoader:
+    """Batch and memoize user lookups for the lifetime of a request
+
+    IDs are queued with prime() and fetched together with a single $in query the
+    next time any user is loaded. Results, including misses, are cached so each
+    user is read at most once per request.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._queued = set()
+
+    def prime(self, user_ids):
+        """Queue user IDs to be fetched with the next load"""
+        for key in map(_key, user_ids):
+            if key and key not in self._cache:
+                self._queued.add(key)
+
+    def load_many(self, user_ids):
+        """Get a dict of user ID string to user for every ID that exists"""
+        keys = [key for key in map(_key, user_ids) if key]
+        self._queued.update(key for key in keys if key not in self._cache)
+        self._dispatch()
+        return {key: self._cache[key] for key in keys if self._cache.get(key)}
+
+    def load(self, user_id):
+        """Get a single user, or None if it does not exist"""
+        key = _key(user_id)
+        if not key:
+            return None
+        return self.load_many([key]).get(key)
+
+    def clear(self, user_id):
+        """Forget a cached user so the next load reads it again"""
+        self._cache.pop(_key(user_id), None)
+
+    def _dispatch(self):
+        if not self._queued:
+            return
+
+        keys = list(self._queued)
+        self._queued.clear()
+        users = mongo.db.users.find({"_id": {"$in": [ObjectId(key) for key in keys]}}, USER_FIELDS)
+        found = {str(user["_id"]): user for user in users}
+        for key in keys:
+            self._cache[key] = found.get(key)
+
+
+def get_user_loader():
+    """Get the user loader for the current request, creating it on first use"""
+    if "user_loader" not in g:
+        g.user_loader = UserLoader()
+    return g.user_loader
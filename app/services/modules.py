@@ -0,0 +1,268 @@
+from bson import ObjectId
+from admin.models import Module
+from services import counters
+from services.pagination import decode_cursor, encode_cursor, keyset_condition
+from services.search import relevance_stage, reindex_modules, search_condition
+
+# Search keys are only for matching, so they are left out of returned modules
+HIDE_SEARCH_KEYS = {"$project": {"search_keys": 0}}
+
+# Equality join of a module with its lead's username and email
+MODULE_LEAD_LOOKUP = [
+    {
+        "$lookup": {
+            "from": "users",
+            "localField": "module_lead_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"username": 1, "email": 1}}],
+            "as": "module_lead_info"
+        }
+    },
+    {"$unwind": {"path": "$module_lead_info", "preserveNullAndEmptyArrays": True}}
+]
+
+
+def get_module(module_id):
+    """Get a single module document, or None if it does not exist"""
+    module_id = str(module_id).strip()
+    if not ObjectId.is_valid(module_id):
+        raise ValueError("Invalid module ID format")
+
+    return Module.collection.find_one({"_id": ObjectId(module_id)}, {"search_keys": 0})
+
+
+def module_filter(search="", review_status=None, academic_year=None, code_prefix=None, module_lead_id=None):
+    """Build the query matching the modules list filters"""
+    match_conditions = {}
+
+    if academic_year is not None:
+        match_conditions["academic_year"] = academic_year
+
+    if review_status == "pending":
+        match_conditions["review_submitted"] = False
+    elif review_status == "reviewed":
+        match_conditions["review_submitted"] = True
+
+    if code_prefix:
+        match_conditions["code_prefix"] = code_prefix.upper()
+
+    if module_lead_id is not None:
+        match_conditions["module_lead_id"] = ObjectId(module_lead_id)
+
+    # Search terms match the indexed keys built from the code, name and lead username
+    search_match = search_condition(search)
+    if search_match:
+        match_conditions.update(search_match)
+
+    return match_conditions
+
+
+def list_modules(search="", review_status=None, academic_year=None, code_prefix=None,
+                 module_lead_id=None, sort_field="module_code", sort_direction=1,
+                 page=1, per_page=10, cursor=None):
+    """Get a page of modules, joined with their module lead, along with the total count
+
+    Filters on indexed module fields are matched first, and the page and total come
+    back from a single $facet. The module lead join only runs on the page being
+    returned, unless the page is sorted by module lead.
+
+    When a cursor from a previous page is given, the page starts right after it on
+    (sort_field, _id) instead of skipping, and the total is not counted.
+    """
+    match_conditions = module_filter(search, review_status, academic_year, code_prefix, module_lead_id)
+
+    pipeline = []
+    if match_conditions:
+        pipeline.append({"$match": match_conditions})
+
+    # Relevance only means something when searching
+    by_relevance = sort_field == "relevance" and "search_keys" in match_conditions
+    if sort_field == "relevance" and not by_relevance:
+        sort_field = "module_code"
+    if by_relevance and cursor:
+        raise ValueError("Cursor pagination is not available when sorting by relevance")
+
+    # Sorting by lead name needs the join before the sort, otherwise join the page only
+    join_before_sort = sort_field == "module_lead"
+    page_pipeline = []
+    if join_before_sort:
+        page_pipeline.extend(MODULE_LEAD_LOOKUP)
+        sort_field = "module_lead_info.username"
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_field, sort_direction)
+        page_pipeline.append({"$match": keyset_condition(sort_field, sort_direction, value, last_id)})
+
+    if by_relevance:
+        page_pipeline.append(relevance_stage(search))
+        page_pipeline.append({"$sort": {"search_score": -1, "module_code": 1, "_id": 1}})
+    else:
+        # _id keeps the order stable when the sort field has duplicates
+        page_pipeline.append({"$sort": {sort_field: sort_direction, "_id": sort_direction}})
+
+    if cursor:
+        # One extra document tells us whether there is a next page
+        page_pipeline.append({"$limit": per_page + 1})
+    elif per_page:
+        page_pipeline.append({"$skip": (page - 1) * per_page})
+        page_pipeline.append({"$limit": per_page})
+
+    page_pipeline.append(HIDE_SEARCH_KEYS)
+    if not join_before_sort:
+        page_pipeline.extend(MODULE_LEAD_LOOKUP)
+
+    if cursor:
+        modules = list(Module.collection.aggregate(pipeline + page_pipeline, allowDiskUse=True))
+        total = None
+        has_more = len(modules) > per_page
+        modules = modules[:per_page]
+    else:
+        pipeline.append({
+            "$facet": {
+                "items": page_pipeline,
+                "total": [{"$count": "total"}]
+            }
+        })
+
+        result = next(Module.collection.aggregate(pipeline, allowDiskUse=True), {})
+        modules = result.get("items", [])
+        total_result = result.get("total", [])
+        total = total_result[0]["total"] if total_result else 0
+        has_more = bool(per_page) and page * per_page < total
+
+    next_cursor = None
+    if has_more and not by_relevance:
+        next_cursor = encode_cursor(modules[-1], sort_field, sort_direction)
+
+    # Format module lead info
+    for module in modules:
+        if "module_lead_info" in module:
+            module["module_lead"] = module["module_lead_info"].get("username", "Unknown")
+            module["module_lead_email"] = module["module_lead_info"].get("email", "")
+            del module["module_lead_info"]
+        else:
+            module["module_lead"] = "Not Assigned"
+            module["module_lead_email"] = ""
+
+    return {
+        "items": modules,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "next_cursor": next_cursor
+    }
+
+
+def iter_modules(search="", review_status=None, academic_year=None, code_prefix=None,
+                 module_lead_id=None, sort_field="module_code", sort_direction=1, batch_size=1000):
+    """Yield every module matching the list filters, joined with its lead, straight from the cursor"""
+    match_conditions = module_filter(search, review_status, academic_year, code_prefix, module_lead_id)
+
+    pipeline = [{"$match": match_conditions}] if match_conditions else []
+    if sort_field == "module_lead":
+        pipeline.extend(MODULE_LEAD_LOOKUP)
+        pipeline.append({"$sort": {"module_lead_info.username": sort_direction, "_id": sort_direction}})
+        pipeline.append(HIDE_SEARCH_KEYS)
+    else:
+        if sort_field == "relevance":
+            sort_field = "module_code"
+        pipeline.append({"$sort": {sort_field: sort_direction, "_id": sort_direction}})
+        pipeline.append(HIDE_SEARCH_KEYS)
+        pipeline.extend(MODULE_LEAD_LOOKUP)
+
+    for module in Module.collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+        lead = module.pop("module_lead_info", None)
+        module["module_lead"] = lead.get("username", "Unknown") if lead else "Not Assigned"
+        module["module_lead_email"] = lead.get("email", "") if lead else ""
+        yield module
+
+
+def count_matching_modules(search="", review_status=None, academic_year=None, code_prefix=None, module_lead_id=None):
+    """Count the modules matching the list filters"""
+    return Module.collection.count_documents(
+        module_filter(search, review_status, academic_year, code_prefix, module_lead_id)
+    )
+
+
+def count_modules(academic_year=None, module_lead_id=None):
+    """Get total, pending and completed module counts with a single aggregation"""
+    query = {}
+    if academic_year is not None:
+        query["academic_year"] = academic_year
+
+    if module_lead_id is not None:
+        query["module_lead_id"] = ObjectId(module_lead_id)
+
+    pipeline = [
+        {"$match": query},
+        {
+            "$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": ["$review_submitted", 1, 0]}}
+            }
+        }
+    ]
+    result = next(Module.collection.aggregate(pipeline), {})
+    total = result.get("total", 0)
+    completed = result.get("completed", 0)
+
+    return {"total": total, "pending": total - completed, "completed": completed}
+
+
+def count_modules_for_lead(module_lead_id, academic_year=None):
+    """Get overall and lead-specific module counts with a single aggregation"""
+    lead_id = ObjectId(module_lead_id)
+    is_lead = {"$eq": ["$module_lead_id", lead_id]}
+
+    pipeline = [
+        {"$match": {"academic_year": academic_year} if academic_year is not None else {}},
+        {
+            "$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": ["$review_submitted", 1, 0]}},
+                "user_total": {"$sum": {"$cond": [is_lead, 1, 0]}},
+                "user_completed": {
+                    "$sum": {"$cond": [{"$and": [is_lead, "$review_submitted"]}, 1, 0]}
+                }
+            }
+        }
+    ]
+    result = next(Module.collection.aggregate(pipeline), {})
+    total, completed = result.get("total", 0), result.get("completed", 0)
+    user_total, user_completed = result.get("user_total", 0), result.get("user_completed", 0)
+
+    return {
+        "counts": {"total": total, "pending": total - completed, "completed": completed},
+        "user_counts": {
+            "total": user_total,
+            "pending": user_total - user_completed,
+            "completed": user_completed
+        }
+    }
+
+
+def get_code_prefixes():
+    """Get the sorted list of distinct module code prefixes"""
+    return sorted(Module.collection.distinct("code_prefix"))
+
+
+def update_module(module_id, data):
+    """Update a module and return the updated document, or None if nothing changed"""
+    previous = Module.collection.find_one(
+        {"_id": ObjectId(str(module_id))},
+        {"academic_year": 1, "module_lead_id": 1, "review_submitted": 1}
+    )
+
+    result = Module.update_module(str(module_id), data)
+    if not result.modified_count:
+        return None
+
+    if {"module_code", "module_name", "module_lead_id"} & set(data):
+        reindex_modules({"_id": ObjectId(str(module_id))})
+
+    module = Module.get_module_by_id(str(module_id))
+    if previous and "module_lead_id" in data:
+        counters.record_module_lead_changed(previous, module.get("module_lead_id"))
+    return module
@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from flask import current_app
+from extensions import mongo
+from services.workers import WorkerPool, start_on_first_request
+from utils.email import BatchSender, build_activation_message, build_custom_message, build_reminder_message
+
+# Message kinds and the builder that turns a stored payload into a flask_mail Message
+MESSAGE_BUILDERS = {
+    "reminder": build_reminder_message,
+    "custom": build_custom_message,
+    "activation": build_activation_message,
+}
+
+# Longest wait between two attempts at the same message
+MAX_RETRY_DELAY = 3600
+
+
+def _collection():
+    return mongo.db.email_outbox
+
+
+def enqueue(kind, payloads):
+    """Queue one message per payload under a shared batch ID and return the batch ID"""
+    if kind not in MESSAGE_BUILDERS:
+        raise ValueError(f"Unknown email kind: {kind}")
+
+    payloads = list(payloads)
+    if not payloads:
+        raise ValueError("No messages to queue")
+
+    batch_id = ObjectId()
+    now = datetime.utcnow()
+    _collection().insert_many([
+        {
+            "batch_id": batch_id,
+            "kind": kind,
+            "recipient": payload.get("recipient_email"),
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "locked_until": None,
+            "last_error": None,
+            "created_at": now,
+            "sent_at": None
+        }
+        for payload in payloads
+    ])
+    return batch_id
+
+
+def claim_next():
+    """Lease the next message that is due, including ones whose previous lease expired"""
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config.get("EMAIL_LEASE_SECONDS", 300))
+    return _collection().find_one_and_update(
+        {
+            "$or": [
+                {"status": "queued", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "locked_until": {"$lte": now}}
+            ]
+        },
+        {
+            "$set": {"status": "sending", "locked_until": now + lease},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def build_message(message):
+    """Build the flask_mail Message for a stored outbox message"""
+    return MESSAGE_BUILDERS[message["kind"]](**message["payload"])
+
+
+def mark_sent(message):
+    _collection().update_one(
+        {"_id": message["_id"]},
+        {"$set": {"status": "sent", "sent_at": datetime.utcnow(), "locked_until": None, "last_error": None}}
+    )
+
+
+def mark_failed(message, error):
+    """Schedule a retry with exponential backoff, or give up after EMAIL_MAX_ATTEMPTS"""
+    max_attempts = current_app.config.get("EMAIL_MAX_ATTEMPTS", 5)
+    update = {"locked_until": None, "last_error": str(error)}
+
+    if message["attempts"] >= max_attempts:
+        update["status"] = "failed"
+    else:
+        base_delay = current_app.config.get("EMAIL_RETRY_DELAY", 30)
+        delay = min(base_delay * 2 ** (message["attempts"] - 1), MAX_RETRY_DELAY)
+        update["status"] = "queued"
+        update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+
+    _collection().update_one({"_id": message["_id"]}, {"$set": update})
+
+
+def process_batch(limit=None):
+    """Deliver up to limit due messages over one SMTP session and return the run's stats"""
+    limit = limit or current_app.config.get("EMAIL_BATCH_SIZE", 50)
+
+    with BatchSender() as sender:
+        for _ in range(limit):
+            message = claim_next()
+            if not message:
+                break
+
+            try:
+                built = build_message(message)
+            except Exception as e:
+                # The sender never saw this message, so count it here to keep the run going
+                current_app.logger.error(f"Outbox message {message['_id']} could not be built: {str(e)}")
+                sender.stats["failed"] += 1
+                mark_failed(message, e)
+                continue
+
+            try:
+                sender.send(built)
+                mark_sent(message)
+            except Exception as e:
+                current_app.logger.error(f"Outbox message {message['_id']} to {message['recipient']} failed: {str(e)}")
+                mark_failed(message, e)
+
+    stats = sender.stats
+    if stats["sent"] or stats["failed"]:
+        record_run(stats)
+        current_app.logger.info(
+            f"Outbox run sent {stats['sent']}, failed {stats['failed']} over "
+            f"{stats['connections']} connection(s) in {stats['seconds']}s"
+        )
+    return stats
+
+
+def record_run(stats):
+    """Store the stats of a delivery run"""
+    mongo.db.email_delivery_runs.insert_one({**stats, "finished_at": datetime.utcnow()})
+
+
+def recent_runs(limit=20):
+    """Get the stats of the most recent delivery runs, newest first"""
+    return list(mongo.db.email_delivery_runs.find().sort("finished_at", -1).limit(limit))
+
+
+def batch_status(batch_id):
+    """Get per-status counts and per-message status for a batch, or None if it does not exist"""
+    messages = list(_collection().find(
+        {"batch_id": ObjectId(batch_id)},
+        {"recipient": 1, "kind": 1, "status": 1, "attempts": 1, "last_error": 1,
+         "next_attempt_at": 1, "sent_at": 1}
+    ))
+    if not messages:
+        return None
+
+    counts = {"queued": 0, "sending": 0, "sent": 0, "failed": 0}
+    for message in messages:
+        counts[message["status"]] = counts.get(message["status"], 0) + 1
+
+    return {
+        "batch_id": batch_id,
+        "counts": counts,
+        "complete": counts["queued"] == 0 and counts["sending"] == 0,
+        "messages": messages
+    }
+
+
+def deliver_due():
+    """Run one delivery batch and report whether it found any work"""
+    stats = process_batch()
+    return bool(stats["sent"] or stats["failed"])
+
+
+def init_outbox_workers(app):
+    """Start the delivery workers when this process handles its first request
+
+    Messages are claimed atomically, so any number of workers, across processes,
+    can work the same outbox.
+    """
+    workers = app.config.get("EMAIL_OUTBOX_WORKERS", 0)
+    if not workers:
+        return None
+
+    pool = WorkerPool(app, "outbox", deliver_due, workers, app.config.get("EMAIL_POLL_INTERVAL", 2))
+    return start_on_first_request(app, pool)
@@ -0,0 +1,54 @@
+import base64
+import binascii
+from bson import json_util
+
+
+def encode_cursor(document, sort_field, sort_direction):
+    """Build an opaque cursor pointing just after document in the given sort order"""
+    value = document
+    for part in sort_field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+
+    payload = json_util.dumps({"f": sort_field, "d": sort_direction, "v": value, "id": document["_id"]})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sort_field, sort_direction):
+    """Decode a cursor into its (value, _id) position
+
+    Raises ValueError if the cursor is malformed or was issued for another sort order.
+    """
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(payload, dict) or "id" not in payload:
+        raise ValueError("Invalid cursor")
+    if payload.get("f") != sort_field or payload.get("d") != sort_direction:
+        raise ValueError("Cursor does not match the requested sort order")
+
+    return payload.get("v"), payload["id"]
+
+
+def keyset_condition(sort_field, sort_direction, value, last_id):
+    """Match the documents that come after (value, last_id) when sorted on (sort_field, _id)"""
+    after = "$gt" if sort_direction == 1 else "$lt"
+
+    # Nulls sort first, so they need spelling out rather than a range comparison
+    if value is None:
+        tie = {sort_field: None, "_id": {after: last_id}}
+        if sort_direction == 1:
+            return {"$or": [{sort_field: {"$ne": None}}, tie]}
+        return tie
+
+    condition = {
+        "$or": [
+            {sort_field: {after: value}},
+            {sort_field: value, "_id": {after: last_id}}
+        ]
+    }
+    # A range comparison never matches nulls, which still lie ahead in descending order
+    if sort_direction == -1:
+        condition["$or"].append({sort_field: None})
+    return condition
@@ -0,0 +1,73 @@
+import hashlib
+import multiprocessing
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Get the shared hashing pool, or None when PASSWORD_HASH_WORKERS is 0"""
+    global _executor
+    workers = current_app.config.get("PASSWORD_HASH_WORKERS", 0)
+    if not workers:
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Workers only ever run generate_password_hash, so forking is safe and
+                # avoids re-importing the app in every worker
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("fork" if "fork" in methods else None)
+                _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _executor
+
+
+def hash_password(password):
+    """Hash one password in the pool so the key derivation does not hold up the calling thread"""
+    executor = _get_executor()
+    if executor is None:
+        return generate_password_hash(password)
+    return executor.submit(generate_password_hash, password).result()
+
+
+def hash_passwords(passwords):
+    """Hash many passwords across the pool and return the hashes in the same order"""
+    passwords = list(passwords)
+    executor = _get_executor()
+    if executor is None or len(passwords) < 2:
+        return [generate_password_hash(password) for password in passwords]
+
+    # A few chunks per worker keeps them all busy without a round trip per password
+    workers = current_app.config["PASSWORD_HASH_WORKERS"]
+    chunk_size = max(1, len(passwords) // (workers * 4))
+    return list(executor.map(generate_password_hash, passwords, chunksize=chunk_size))
+
+
+def check_password(password_hash, password):
+    """Check a password, treating accounts that have not been activated as having none"""
+    if not password_hash:
+        return False
+    return check_password_hash(password_hash, password)
+
+
+def hash_token(token):
+    """Tokens are random, so a fast hash is enough to keep them unusable if the database leaks"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def activation_fields():
+    """Create a single-use activation token and return it with the fields to store on the account"""
+    token = secrets.token_urlsafe(32)
+    ttl = current_app.config.get("ACTIVATION_TOKEN_TTL", 7 * 24 * 3600)
+    return token, {
+        "password": None,
+        "activation_token": hash_token(token),
+        "activation_expires_at": datetime.utcnow() + timedelta(seconds=ttl)
+    }
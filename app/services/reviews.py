@@ -0,0 +1,139 @@
+from bson import ObjectId
+from admin.models import Module, Review
+from services import counters
+from services.modules import MODULE_LEAD_LOOKUP, module_filter
+
+# Reviews carry several free-text answers, so fewer of them fit in each cursor batch
+REVIEW_EXPORT_BATCH_SIZE = 200
+
+# Equality join of a module with its review, on the unique module_id index
+REVIEW_LOOKUP = [
+    {
+        "$lookup": {
+            "from": "module_reviews",
+            "localField": "_id",
+            "foreignField": "module_id",
+            "pipeline": [{"$project": {"module_id": 0, "edit_history": 0}}],
+            "as": "review"
+        }
+    },
+    {"$unwind": "$review"}
+]
+
+# Equality join of a review with its reviewer's username
+REVIEWER_LOOKUP = [
+    {
+        "$lookup": {
+            "from": "users",
+            "localField": "review.reviewer_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"username": 1}}],
+            "as": "reviewer_info"
+        }
+    },
+    {"$unwind": {"path": "$reviewer_info", "preserveNullAndEmptyArrays": True}}
+]
+
+
+def get_review(review_id):
+    """Get a single review document, or None if it does not exist"""
+    review_id = str(review_id).strip()
+    if not ObjectId.is_valid(review_id):
+        raise ValueError("Invalid review ID format")
+
+    return Review.collection.find_one({"_id": ObjectId(review_id)})
+
+
+def get_review_for_module(module_id):
+    """Get the review submitted for a module, or None if there is none"""
+    module_id = str(module_id).strip()
+    if not ObjectId.is_valid(module_id):
+        raise ValueError("Invalid module ID format")
+
+    return Review.collection.find_one({"module_id": ObjectId(module_id)})
+
+
+def create_review(module_id, reviewer_id, **fields):
+    """Create a review and mark its module as reviewed"""
+    if not module_id or not reviewer_id:
+        raise ValueError("Missing required fields")
+
+    result = Review.create_review(
+        module_id=module_id,
+        reviewer_id=reviewer_id,
+        enhancement_plan=fields.get("enhancement_plan_update"),
+        student_attainment=fields.get("student_attainment"),
+        student_feedback=fields.get("student_feedback"),
+        risks=fields.get("risks"),
+        engagement_rating=int(fields.get("engagement_rating") or 0),
+        learning_environment_rating=int(fields.get("learning_environment_rating") or 0),
+        timetabling_rating=int(fields.get("timetabling_rating") or 0),
+        enhancement_plans=fields.get("enhancement_plans", [])
+    )
+
+    # Update module review status, counting it only on the first submission
+    previous = Module.update_review_status(module_id, reviewer_id)
+    if previous and not previous.get("review_submitted"):
+        counters.record_module_reviewed(previous)
+    return result
+
+
+def update_review(review_id, editor_id, update_data):
+    """Update a review, recording the edit in its history"""
+    return Review.update_review(review_id, editor_id, data=update_data)
+
+
+def _reviewed_modules_pipeline(academic_year, search="", code_prefix=None):
+    """Reviewed modules of a year in module code order, each joined with its review"""
+    return [
+        {"$match": module_filter(search, "reviewed", academic_year, code_prefix)},
+        {"$sort": {"module_code": 1, "_id": 1}},
+        {"$project": {"module_code": 1, "module_name": 1, "academic_year": 1, "module_lead_id": 1}},
+        *REVIEW_LOOKUP
+    ]
+
+
+def count_reviews(academic_year, search="", code_prefix=None):
+    """Count the review documents of a year's modules, which is the number of rows iter_reviews yields"""
+    pipeline = _reviewed_modules_pipeline(academic_year, search, code_prefix)
+    pipeline.append({"$count": "total"})
+    result = next(Module.collection.aggregate(pipeline), None)
+    return result["total"] if result else 0
+
+
+def iter_reviews(academic_year, search="", code_prefix=None, batch_size=REVIEW_EXPORT_BATCH_SIZE):
+    """Yield every review of a year, flattened onto its module's code, name, lead and reviewer"""
+    pipeline = _reviewed_modules_pipeline(academic_year, search, code_prefix)
+    pipeline.extend(MODULE_LEAD_LOOKUP)
+    pipeline.extend(REVIEWER_LOOKUP)
+
+    for module in Module.collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+        lead = module.pop("module_lead_info", None)
+        reviewer = module.pop("reviewer_info", None)
+        review = module.pop("review")
+        yield {
+            **review,
+            "module_code": module.get("module_code"),
+            "module_name": module.get("module_name"),
+            "academic_year": module.get("academic_year"),
+            "module_lead": lead.get("username", "Unknown") if lead else "Not Assigned",
+            "reviewer": reviewer.get("username", "Unknown") if reviewer else "Unknown"
+        }
+
+
+def iter_enhancement_plans(academic_year, search="", code_prefix=None, batch_size=REVIEW_EXPORT_BATCH_SIZE):
+    """Yield one row per enhancement plan of the year's reviews, with its module's code and name"""
+    pipeline = _reviewed_modules_pipeline(academic_year, search, code_prefix)
+    pipeline.extend([
+        {"$unwind": "$review.enhancement_plans"},
+        {
+            "$project": {
+                "_id": 0,
+                "module_code": 1,
+                "module_name": 1,
+                "plan": "$review.enhancement_plans.plan",
+                "details": "$review.enhancement_plans.details"
+            }
+        }
+    ])
+    yield from Module.collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
@@ -0,0 +1,116 @@
+import re
+import unicodedata
+from bson import ObjectId
+from pymongo import UpdateOne
+from extensions import mongo
+
+# Keys are word prefixes of this length range, so "intro" matches "Introduction"
+MAX_PREFIX_LENGTH = 20
+REINDEX_BATCH_SIZE = 1000
+
+# Stored with every module's keys to mark the current key format; normalized input
+# never contains "~", so it can't be searched for. Modules without it are reindexed
+# at startup.
+SEARCH_KEYS_MARKER = "~codes"
+
+
+def normalize(text):
+    """Lower-case text, strip accents and replace punctuation with spaces"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[\W_]+", " ", text.casefold()).strip()
+
+
+def _prefixes(word):
+    return {word[:length] for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1)}
+
+
+def _substrings(word):
+    return {key for start in range(len(word)) for key in _prefixes(word[start:])}
+
+
+def module_search_keys(module_code, module_name, module_lead_name=None):
+    """Build the search keys stored on a module
+
+    Every word of the name and lead username contributes its prefixes. Codes are
+    short, so every substring of the code, and of its compact form, is a key: "cs101"
+    finds "CS 101" and "11001" finds "AC11001".
+    """
+    keys = {SEARCH_KEYS_MARKER}
+    code = normalize(module_code)
+    for word in f"{code} {code.replace(' ', '')}".split():
+        keys.update(_substrings(word))
+    for text in (normalize(module_name), normalize(module_lead_name)):
+        for word in text.split():
+            keys.update(_prefixes(word))
+    return sorted(keys)
+
+
+def search_terms(search):
+    """Split raw user input into the keys a matching module must all have"""
+    return [word[:MAX_PREFIX_LENGTH] for word in normalize(search).split()]
+
+
+def search_condition(search):
+    """Match modules having every search term, or None if the input has no terms"""
+    terms = search_terms(search)
+    if not terms:
+        return None
+    return {"search_keys": {"$all": terms}}
+
+
+def relevance_stage(search):
+    """Score matches: exact code first, then code prefix, then name prefix"""
+    query = normalize(search)
+    compact_query = query.replace(" ", "")
+    code = {"$toLower": "$module_code"}
+    name = {"$toLower": "$module_name"}
+
+    return {
+        "$addFields": {
+            "search_score": {
+                "$add": [
+                    {"$cond": [{"$eq": [code, compact_query]}, 4, 0]},
+                    {"$cond": [{"$eq": [{"$indexOfCP": [code, compact_query]}, 0]}, 2, 0]},
+                    {"$cond": [{"$eq": [{"$indexOfCP": [name, query]}, 0]}, 1, 0]}
+                ]
+            }
+        }
+    }
+
+
+def reindex_modules(query=None):
+    """Recompute search keys for the modules matching query and return how many were updated"""
+    modules = list(mongo.db.modules.find(
+        query or {},
+        {"module_code": 1, "module_name": 1, "module_lead_id": 1}
+    ))
+
+    lead_ids = {module["module_lead_id"] for module in modules if isinstance(module.get("module_lead_id"), ObjectId)}
+    lead_names = {
+        user["_id"]: user.get("username")
+        for user in mongo.db.users.find({"_id": {"$in": list(lead_ids)}}, {"username": 1})
+    } if lead_ids else {}
+
+    updated = 0
+    operations = []
+    for module in modules:
+        keys = module_search_keys(
+            module.get("module_code"),
+            module.get("module_name"),
+            lead_names.get(module.get("module_lead_id"))
+        )
+        operations.append(UpdateOne({"_id": module["_id"]}, {"$set": {"search_keys": keys}}))
+
+        if len(operations) >= REINDEX_BATCH_SIZE:
+            updated += mongo.db.modules.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        updated += mongo.db.modules.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def backfill_search_keys():
+    """Index any modules stored without search keys, or with keys in an older format"""
+    return reindex_modules({"search_keys": {"$ne": SEARCH_KEYS_MARKER}})
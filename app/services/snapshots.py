@@ -0,0 +1,334 @@
+import json
+import os
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flask import current_app
+from extensions import mongo
+from services.modules import MODULE_LEAD_LOOKUP
+
+# Rows are handed to the Parquet writer in record batches of this size
+SNAPSHOT_BATCH_ROWS = 5000
+
+MODULE_SCHEMA = pa.schema([
+    ("module_id", pa.string()),
+    ("academic_year", pa.int16()),
+    ("module_code", pa.string()),
+    ("module_name", pa.string()),
+    ("code_prefix", pa.dictionary(pa.int16(), pa.string())),
+    ("level", pa.string()),
+    ("in_use", pa.bool_()),
+    ("module_lead_id", pa.string()),
+    ("module_lead", pa.string()),
+    ("review_submitted", pa.bool_()),
+    ("reviewed_by", pa.string()),
+    ("review_date", pa.timestamp("ms")),
+    ("created_at", pa.timestamp("ms")),
+])
+
+REVIEW_SCHEMA = pa.schema([
+    ("review_id", pa.string()),
+    ("module_id", pa.string()),
+    ("academic_year", pa.int16()),
+    ("module_code", pa.string()),
+    ("reviewer_id", pa.string()),
+    ("review_date", pa.timestamp("ms")),
+    ("last_edit_date", pa.timestamp("ms")),
+    ("edit_count", pa.int16()),
+    # Ratings run from 1 (Strongly Disagree) to 4 (Strongly Agree), 0 when unanswered
+    ("engagement_rating", pa.int8()),
+    ("learning_environment_rating", pa.int8()),
+    ("timetabling_rating", pa.int8()),
+    ("enhancement_plan_update", pa.string()),
+    ("student_attainment", pa.string()),
+    ("student_feedback", pa.string()),
+    ("risks", pa.string()),
+    ("enhancement_plan_count", pa.int16()),
+])
+
+ENHANCEMENT_PLAN_SCHEMA = pa.schema([
+    ("review_id", pa.string()),
+    ("module_id", pa.string()),
+    ("academic_year", pa.int16()),
+    ("module_code", pa.string()),
+    ("position", pa.int16()),
+    ("plan", pa.dictionary(pa.int8(), pa.string())),
+    ("details", pa.string()),
+])
+
+# Review fields read for a snapshot; only the tail of edit_history is kept
+REVIEW_PROJECTION = {
+    "module_id": 1,
+    "reviewer_id": 1,
+    "review_date": 1,
+    "engagement_rating": 1,
+    "learning_environment_rating": 1,
+    "timetabling_rating": 1,
+    "enhancement_plan_update": 1,
+    "student_attainment": 1,
+    "student_feedback": 1,
+    "risks": 1,
+    "enhancement_plans": 1,
+    "last_edit": {"$last": "$edit_history"},
+    "edit_count": {"$size": {"$ifNull": ["$edit_history", []]}},
+}
+
+
+def snapshot_dir(academic_year):
+    """Directory holding the snapshot files of an academic year"""
+    base = current_app.config.get("SNAPSHOT_DIR") or os.path.join(current_app.instance_path, "snapshots")
+    path = os.path.join(base, str(academic_year))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _id(value):
+    return str(value) if value is not None else None
+
+
+def _rating(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def module_row(module):
+    lead = module.get("module_lead_info")
+    return {
+        "module_id": str(module["_id"]),
+        "academic_year": module.get("academic_year"),
+        "module_code": module.get("module_code"),
+        "module_name": module.get("module_name"),
+        "code_prefix": module.get("code_prefix"),
+        "level": str(module["level"]) if module.get("level") is not None else None,
+        "in_use": module.get("in_use"),
+        "module_lead_id": _id(module.get("module_lead_id")),
+        "module_lead": lead.get("username") if lead else None,
+        "review_submitted": bool(module.get("review_submitted")),
+        "reviewed_by": _id(module.get("reviewed_by")),
+        "review_date": module.get("review_date"),
+        "created_at": module.get("created_at"),
+    }
+
+
+def review_rows(review, academic_year, module_code):
+    """Flatten a review into its review row and one row per enhancement plan"""
+    review_id = str(review["_id"])
+    module_id = str(review["module_id"])
+    plans = review.get("enhancement_plans") or []
+    last_edit = review.get("last_edit") or {}
+
+    row = {
+        "review_id": review_id,
+        "module_id": module_id,
+        "academic_year": academic_year,
+        "module_code": module_code,
+        "reviewer_id": _id(review.get("reviewer_id")),
+        "review_date": review.get("review_date"),
+        "last_edit_date": last_edit.get("edit_date"),
+        "edit_count": review.get("edit_count", 0),
+        "engagement_rating": _rating(review.get("engagement_rating")),
+        "learning_environment_rating": _rating(review.get("learning_environment_rating")),
+        "timetabling_rating": _rating(review.get("timetabling_rating")),
+        "enhancement_plan_update": review.get("enhancement_plan_update"),
+        "student_attainment": review.get("student_attainment"),
+        "student_feedback": review.get("student_feedback"),
+        "risks": review.get("risks"),
+        "enhancement_plan_count": len(plans),
+    }
+    plan_rows = [
+        {
+            "review_id": review_id,
+            "module_id": module_id,
+            "academic_year": academic_year,
+            "module_code": module_code,
+            "position": position,
+            "plan": plan.get("plan"),
+            "details": plan.get("details"),
+        }
+        for position, plan in enumerate(plans)
+    ]
+    return row, plan_rows
+
+
+class SnapshotWriter:
+    """Write rows to a Parquet file in record batches, replacing the file only once it is complete
+
+    Readers memory-mapping the previous snapshot never see a partly written file.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.rows = []
+        self.count = 0
+        self._writer = pq.ParquetWriter(f"{path}.tmp", schema, compression="zstd")
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= SNAPSHOT_BATCH_ROWS:
+            self.flush()
+
+    def write_table(self, table):
+        self.flush()
+        # Parquet reads dictionary columns back with int32 indices, so match the file's schema again
+        self._writer.write_table(table.cast(self.schema))
+        self.count += table.num_rows
+
+    def flush(self):
+        if self.rows:
+            self._writer.write_batch(pa.RecordBatch.from_pylist(self.rows, schema=self.schema))
+            self.count += len(self.rows)
+            self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        self._writer.close()
+        if exc_type is None:
+            os.replace(f"{self.path}.tmp", self.path)
+        else:
+            os.remove(f"{self.path}.tmp")
+
+
+def _write_modules(directory, academic_year):
+    pipeline = [
+        {"$match": {"academic_year": academic_year}},
+        {"$sort": {"module_code": 1, "_id": 1}},
+        {"$project": {"search_keys": 0, "module_lead_name": 0}},
+        *MODULE_LEAD_LOOKUP
+    ]
+    with SnapshotWriter(os.path.join(directory, "modules.parquet"), MODULE_SCHEMA) as writer:
+        for module in mongo.db.modules.aggregate(pipeline, allowDiskUse=True, batchSize=1000):
+            writer.write(module_row(module))
+    return writer.count
+
+
+def _year_reviews(academic_year):
+    """Every review of a year's modules, with the module's code"""
+    pipeline = [
+        {"$match": {"academic_year": academic_year, "review_submitted": True}},
+        {"$sort": {"module_code": 1, "_id": 1}},
+        {"$project": {"module_code": 1}},
+        {
+            "$lookup": {
+                "from": "module_reviews",
+                "localField": "_id",
+                "foreignField": "module_id",
+                "pipeline": [{"$project": REVIEW_PROJECTION}],
+                "as": "review"
+            }
+        },
+        {"$unwind": "$review"}
+    ]
+    for module in mongo.db.modules.aggregate(pipeline, allowDiskUse=True, batchSize=200):
+        yield module["review"], module["module_code"]
+
+
+def _changed_reviews(academic_year, since):
+    """Reviews of a year's modules submitted or edited after since, with the module's code"""
+    pipeline = [
+        {"$match": {"$or": [{"review_date": {"$gt": since}}, {"edit_history.edit_date": {"$gt": since}}]}},
+        {"$project": REVIEW_PROJECTION},
+        {
+            "$lookup": {
+                "from": "modules",
+                "localField": "module_id",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"module_code": 1, "academic_year": 1}}],
+                "as": "module"
+            }
+        },
+        {"$unwind": "$module"},
+        {"$match": {"module.academic_year": academic_year}}
+    ]
+    for review in mongo.db.module_reviews.aggregate(pipeline, allowDiskUse=True, batchSize=200):
+        yield review, review.pop("module")["module_code"]
+
+
+def _write_reviews(directory, academic_year, reviews, keep=None):
+    """Write the review and enhancement plan files from reviews
+
+    keep is a function returning the rows of a previous file to carry over,
+    given that file's name.
+    """
+    reviews_path = os.path.join(directory, "reviews.parquet")
+    plans_path = os.path.join(directory, "enhancement_plans.parquet")
+
+    with SnapshotWriter(reviews_path, REVIEW_SCHEMA) as review_writer, \
+            SnapshotWriter(plans_path, ENHANCEMENT_PLAN_SCHEMA) as plan_writer:
+        review_ids = []
+        for review, module_code in reviews:
+            row, plan_rows = review_rows(review, academic_year, module_code)
+            review_writer.write(row)
+            review_ids.append(row["review_id"])
+            for plan_row in plan_rows:
+                plan_writer.write(plan_row)
+
+        if keep:
+            review_writer.write_table(keep(reviews_path, review_ids))
+            plan_writer.write_table(keep(plans_path, review_ids))
+
+    return review_writer.count, plan_writer.count, len(review_ids)
+
+
+def _unchanged_rows(path, changed_review_ids):
+    """Rows of an existing snapshot file whose review has not changed"""
+    table = pq.read_table(path, memory_map=True)
+    changed = pa.array(changed_review_ids, type=pa.string())
+    return table.filter(pc.invert(pc.is_in(table["review_id"], value_set=changed)))
+
+
+def read_manifest(academic_year):
+    """Get the manifest of a year's snapshot, or None if it has never been written"""
+    path = os.path.join(snapshot_dir(academic_year), "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["watermark"] = datetime.fromisoformat(manifest["watermark"])
+    return manifest
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, "manifest.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({**manifest, "watermark": manifest["watermark"].isoformat()}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def refresh_snapshot(academic_year, full=False):
+    """Write the Parquet snapshot of an academic year and return its manifest
+
+    Modules are rewritten each time. Reviews are refreshed incrementally: only
+    reviews whose review_date or latest edit_history entry is newer than the
+    previous refresh are read, and they replace their rows in the existing files.
+    """
+    directory = snapshot_dir(academic_year)
+    previous = None if full else read_manifest(academic_year)
+    started_at = datetime.utcnow()
+
+    modules = _write_modules(directory, academic_year)
+    if previous:
+        reviews, plans, changed = _write_reviews(
+            directory, academic_year,
+            _changed_reviews(academic_year, previous["watermark"]),
+            keep=_unchanged_rows
+        )
+    else:
+        reviews, plans, changed = _write_reviews(directory, academic_year, _year_reviews(academic_year))
+
+    manifest = {
+        "academic_year": academic_year,
+        # Anything written while this refresh ran is picked up by the next one
+        "watermark": started_at,
+        "incremental": bool(previous),
+        "counts": {"modules": modules, "reviews": reviews, "enhancement_plans": plans, "reviews_read": changed}
+    }
+    _write_manifest(directory, manifest)
+    current_app.logger.info(f"Snapshot for {academic_year}: {manifest['counts']}")
+    return manifest
@@ -0,0 +1,84 @@
+import hashlib
+from gridfs import GridFSBucket
+from extensions import mongo
+
+# GridFS bucket holding uploaded spreadsheets and the rows parsed from them
+BUCKET_NAME = "uploads"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def _bucket():
+    return GridFSBucket(mongo.db, bucket_name=BUCKET_NAME)
+
+
+def fingerprint(source):
+    """SHA-256 of a file given by path or as a stream, read in chunks"""
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, "rb") as stream:
+            for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+def _find(sha256, kind):
+    existing = mongo.db[f"{BUCKET_NAME}.files"].find_one(
+        {"metadata.sha256": sha256, "metadata.kind": kind}, {"_id": 1}
+    )
+    return existing["_id"] if existing else None
+
+
+def find_spreadsheet(sha256):
+    """GridFS file ID of an archived spreadsheet, or None if that content was never uploaded"""
+    return _find(sha256, "spreadsheet")
+
+
+def find_parsed(sha256):
+    """GridFS file ID of the parsed rows of a spreadsheet, or None if it has not been parsed yet"""
+    return _find(sha256, "parsed")
+
+
+def archive_spreadsheet(path, filename, mime_type, sha256):
+    """Store an uploaded spreadsheet, once per distinct content, and return its GridFS file ID"""
+    file_id = _find(sha256, "spreadsheet")
+    if file_id:
+        return file_id
+
+    with open(path, "rb") as source:
+        return _bucket().upload_from_stream(
+            filename, source, metadata={"kind": "spreadsheet", "sha256": sha256, "mime_type": mime_type}
+        )
+
+
+def archive_parsed(path, sha256):
+    """Store the rows parsed from a spreadsheet and return their GridFS file ID"""
+    file_id = _find(sha256, "parsed")
+    if file_id:
+        return file_id
+
+    with open(path, "rb") as source:
+        return _bucket().upload_from_stream(
+            f"{sha256}.ndjson", source, metadata={"kind": "parsed", "sha256": sha256}
+        )
+
+
+def download(file_id, path):
+    """Write an archived file to path"""
+    with open(path, "wb") as target:
+        _bucket().download_to_stream(file_id, target)
+
+
+def prune(keep_ids, uploaded_before):
+    """Delete archived files uploaded before a cutoff whose ID is not in keep_ids and return how many"""
+    bucket = _bucket()
+    deleted = 0
+    for stored in mongo.db[f"{BUCKET_NAME}.files"].find({"uploadDate": {"$lt": uploaded_before}}, {"_id": 1}):
+        if stored["_id"] not in keep_ids:
+            bucket.delete(stored["_id"])
+            deleted += 1
+    return deleted
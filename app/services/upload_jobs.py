@@ -0,0 +1,293 @@
+import os
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from flask import current_app
+from extensions import mongo
+from services import upload_archive
+from services.uploads import MissingColumnsError, PARSED_MIME_TYPE, XLSX_MIME_TYPE, ingest_modules
+from services.workers import WorkerPool, start_on_first_request
+from utils.spooling import keep_upload, upload_dir
+
+# Job states; queued and running jobs are still in progress
+ACTIVE_STATUSES = ("queued", "running")
+
+# Warnings and errors kept on a finished job, so the document stays well under 16MB
+MAX_STORED_MESSAGES = 1000
+
+
+def _collection():
+    return mongo.db.upload_jobs
+
+
+def _insert_job(job_id, fields):
+    progress = {"total_processed": 0, "modules_added": 0, "users_added": 0, "warnings": 0, "errors": 0}
+    if fields["mode"] == "sync":
+        progress.update({"modules_updated": 0, "modules_unchanged": 0})
+
+    _collection().insert_one({
+        "_id": job_id,
+        **fields,
+        "status": "queued",
+        "attempts": 0,
+        "locked_until": None,
+        "progress": progress,
+        "result": None,
+        "message": None,
+        "created_at": datetime.utcnow(),
+        "started_at": None,
+        "finished_at": None
+    })
+    return job_id
+
+
+def create_job(fileobj, filename, mime_type, academic_year, mode="insert", created_by=None, sha256=None):
+    """Keep and archive an uploaded spreadsheet for the workers and return the new job's ID
+
+    A spreadsheet whose content has been parsed before is queued from its archived
+    rows instead, so it is not parsed again.
+    """
+    job_id = ObjectId()
+    sha256 = sha256 or upload_archive.fingerprint(fileobj)
+    fields = {
+        "filename": filename,
+        "sha256": sha256,
+        "academic_year": academic_year,
+        "mode": mode,
+        "created_by": created_by
+    }
+
+    parsed_file_id = upload_archive.find_parsed(sha256)
+    if parsed_file_id:
+        return _insert_job(job_id, {
+            **fields,
+            "path": os.path.join(upload_dir(), f"{job_id}.ndjson"),
+            "mime_type": PARSED_MIME_TYPE,
+            "source": "parsed",
+            "file_id": upload_archive.find_spreadsheet(sha256),
+            "parsed_file_id": parsed_file_id
+        })
+
+    extension = ".xlsx" if mime_type == XLSX_MIME_TYPE else ".xls"
+    path = os.path.join(upload_dir(), f"{job_id}{extension}")
+    keep_upload(fileobj, path)
+    return _insert_job(job_id, {
+        **fields,
+        "path": path,
+        "mime_type": mime_type,
+        "source": "spreadsheet",
+        "file_id": upload_archive.archive_spreadsheet(path, filename, mime_type, sha256),
+        "parsed_file_id": None
+    })
+
+
+def reapply_job(job_id, academic_year, mode=None, created_by=None):
+    """Queue an earlier upload again from its archived parsed rows and return the new job's ID"""
+    original = _collection().find_one({"_id": ObjectId(job_id)})
+    if not original:
+        return None
+    if not original.get("parsed_file_id"):
+        raise ValueError("This upload has no archived rows to re-apply")
+
+    new_job_id = ObjectId()
+    return _insert_job(new_job_id, {
+        "filename": original["filename"],
+        "path": os.path.join(upload_dir(), f"{new_job_id}.ndjson"),
+        "mime_type": PARSED_MIME_TYPE,
+        "source": "parsed",
+        "sha256": original["sha256"],
+        "file_id": original["file_id"],
+        "parsed_file_id": original["parsed_file_id"],
+        "reapplied_from": original["_id"],
+        "academic_year": academic_year,
+        "mode": mode or original.get("mode", "insert"),
+        "created_by": created_by
+    })
+
+
+def find_cached(sha256, academic_year, mode):
+    """Get the latest completed job for the same spreadsheet, year and mode, or None"""
+    return _collection().find_one(
+        {"sha256": sha256, "academic_year": academic_year, "mode": mode, "status": "completed"},
+        {"path": 0},
+        sort=[("finished_at", -1)]
+    )
+
+
+def claim_next():
+    """Lease the oldest queued job, or a running job whose worker stopped renewing its lease"""
+    now = datetime.utcnow()
+    return _collection().find_one_and_update(
+        {
+            "$or": [
+                {"status": "queued"},
+                {"status": "running", "locked_until": {"$lte": now}}
+            ]
+        },
+        {
+            "$set": {"status": "running", "started_at": now, "locked_until": now + _lease()},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _lease():
+    return timedelta(seconds=current_app.config.get("UPLOAD_LEASE_SECONDS", 600))
+
+
+def update_progress(job_id, progress):
+    """Store a job's running counts and renew its lease"""
+    _collection().update_one(
+        {"_id": job_id},
+        {"$set": {"progress": progress, "locked_until": datetime.utcnow() + _lease()}}
+    )
+
+
+def finish_job(job, status, message, result=None, errors=None):
+    """Record the outcome of a job and remove its saved spreadsheet"""
+    update = {
+        "status": status,
+        "message": message,
+        "locked_until": None,
+        "finished_at": datetime.utcnow()
+    }
+    if result is not None:
+        warnings, result_errors = result["warnings"], result["errors"]
+        update["progress"] = {**result["stats"], "warnings": len(warnings), "errors": len(result_errors)}
+        update["result"] = {
+            "stats": result["stats"],
+            "warnings": warnings[:MAX_STORED_MESSAGES],
+            "errors": result_errors[:MAX_STORED_MESSAGES]
+        }
+    elif errors:
+        update["result"] = {"stats": job["progress"], "warnings": [], "errors": errors}
+
+    _collection().update_one({"_id": job["_id"]}, {"$set": update})
+
+    try:
+        os.remove(job["path"])
+    except OSError:
+        pass
+
+
+def _local_source(job):
+    """Path of a job's input on this machine, fetched from the archive if it was queued elsewhere"""
+    if os.path.isfile(job["path"]):
+        return job["path"]
+    file_id = job["parsed_file_id"] if job.get("source") == "parsed" else job.get("file_id")
+    if not file_id:
+        raise ValueError("The uploaded file is no longer available")
+    upload_archive.download(file_id, job["path"])
+    return job["path"]
+
+
+def run_job(job):
+    """Parse and insert the spreadsheet of a claimed job
+
+    Re-running a job that was interrupted is safe: modules already stored for the
+    year are skipped, or in sync mode already match, and existing users are reused.
+    The rows parsed from a spreadsheet seen for the first time are archived, so the
+    upload can be re-applied later without parsing it again.
+    """
+    if job["attempts"] > current_app.config.get("UPLOAD_MAX_ATTEMPTS", 3):
+        finish_job(job, "failed", "The upload was interrupted too many times")
+        return
+
+    capture_path = None
+    if job.get("source") == "spreadsheet":
+        capture_path = os.path.join(upload_dir(), f"{job['_id']}.parsed.ndjson")
+
+    try:
+        with open(capture_path, "w", encoding="utf-8") if capture_path else nullcontext() as capture:
+            result = ingest_modules(
+                _local_source(job),
+                job["mime_type"],
+                job["academic_year"],
+                progress=lambda progress: update_progress(job["_id"], progress),
+                mode=job.get("mode", "insert"),
+                capture=capture
+            )
+
+        if capture_path and result["read_complete"]:
+            parsed_file_id = upload_archive.archive_parsed(capture_path, job["sha256"])
+            _collection().update_one({"_id": job["_id"]}, {"$set": {"parsed_file_id": parsed_file_id}})
+    except MissingColumnsError as e:
+        finish_job(job, "failed", str(e), errors=e.columns)
+        return
+    except (ValueError, OSError) as e:
+        finish_job(job, "failed", str(e), errors=[str(e)])
+        return
+    finally:
+        if capture_path and os.path.exists(capture_path):
+            os.remove(capture_path)
+
+    success = len(result["errors"]) == 0
+    finish_job(job, "completed", "File processed successfully" if success else "File processed with warnings", result)
+    current_app.logger.info(f"Upload job {job['_id']} ({job['filename']}): {result['stats']}")
+
+
+def process_next():
+    """Run the next upload job and report whether there was one"""
+    job = claim_next()
+    if not job:
+        return False
+
+    try:
+        run_job(job)
+    except Exception as e:
+        current_app.logger.error(f"Upload job {job['_id']} failed: {str(e)}")
+        finish_job(job, "failed", f"Server error: {str(e)}", errors=[str(e)])
+    return True
+
+
+def prune_archive(grace_seconds=24 * 3600):
+    """Delete archived spreadsheets and parsed rows that no remaining job refers to
+
+    Jobs expire after 90 days, and their archived files go with them on the next
+    prune. Files newer than the grace period are kept, since a job being created
+    archives its spreadsheet just before the job is stored.
+    """
+    keep_ids = set()
+    for field in ("file_id", "parsed_file_id"):
+        keep_ids.update(file_id for file_id in _collection().distinct(field) if file_id)
+    return upload_archive.prune(keep_ids, datetime.utcnow() - timedelta(seconds=grace_seconds))
+
+
+def get_job(job_id):
+    return _collection().find_one({"_id": ObjectId(job_id)}, {"path": 0})
+
+
+def job_status(job):
+    """Public view of a job: its state, running counts and, once finished, its warnings and errors"""
+    result = job.get("result") or {}
+    return {
+        "job_id": job["_id"],
+        "filename": job["filename"],
+        "academic_year": job["academic_year"],
+        "mode": job.get("mode", "insert"),
+        "sha256": job.get("sha256"),
+        "reapplied_from": job.get("reapplied_from"),
+        "can_reapply": bool(job.get("parsed_file_id")),
+        "status": job["status"],
+        "complete": job["status"] not in ACTIVE_STATUSES,
+        "message": job.get("message"),
+        "progress": job["progress"],
+        "warnings": result.get("warnings", []),
+        "errors": result.get("errors", []),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at")
+    }
+
+
+def init_upload_workers(app):
+    """Start the upload workers when this process handles its first request"""
+    workers = app.config.get("UPLOAD_WORKERS", 0)
+    if not workers:
+        return None
+
+    pool = WorkerPool(app, "upload", process_next, workers, app.config.get("UPLOAD_POLL_INTERVAL", 2))
+    return start_on_first_request(app, pool)
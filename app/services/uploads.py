@@ -0,0 +1,581 @@
+import json
+import re
+from itertools import islice
+from bson import ObjectId
+from openpyxl import load_workbook
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import pandas as pd
+from flask import current_app
+from extensions import mongo
+from services import counters, outbox
+from services.passwords import activation_fields, hash_passwords
+from services.search import module_search_keys
+from base.utils import get_academic_year
+
+# Column Mapping for Excel
+EXCEL_COLUMNS = {
+    'module_code': ['module code', 'module', 'code'],
+    'module_name': ['name', 'module name'],
+    'level': ['level'],
+    'tutor': ['tutor', 'module lead', 'lecturer'],
+    'in_use': ['in use', 'active', 'status']
+}
+
+MODULE_CODE_PATTERN = r"^[A-Z]{2}[0-9]{5}$"  # Example: AC11001
+ALTERNATE_MODULE_CODE_PATTERN = r"^[A-Z]{8}[0-9]{1}$" # Example: INDPLACE1
+
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+XLS_MIME_TYPE = "application/vnd.ms-excel"
+ALLOWED_MIME_TYPES = (XLSX_MIME_TYPE, XLS_MIME_TYPE)
+# Rows already parsed from a spreadsheet, one JSON object per line, as archived for re-applying
+PARSED_MIME_TYPE = "application/x-ndjson"
+PARSED_HEADER = ("module code", "name", "level", "tutor", "in use")
+PARSED_FIELDS = ("module_code", "module_name", "level", "tutor", "in_use")
+
+# Rows are validated and written in chunks of this many rows so memory stays flat
+INSERT_CHUNK_SIZE = 500
+
+# in_use values that mean the module is in use; anything else, including a blank, means it is not
+IN_USE_VALUES = ("y", "yes", "1", "true", "active")
+REQUIRED_FIELDS = ("module_code", "module_name", "level")
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Upload modes: "insert" adds new modules and skips stored ones, "sync" also updates stored ones
+UPLOAD_MODES = ("insert", "sync")
+
+# Module fields a sync upload compares against the stored module
+SYNC_FIELDS = ("module_name", "level", "module_lead_id", "in_use")
+
+# Whole numbers read from a spreadsheet as floats, such as "4.0"
+WHOLE_NUMBER = r"^(-?\d+)\.0$"
+
+
+class MissingColumnsError(ValueError):
+    """Raised when the header row lacks required columns"""
+
+    def __init__(self, columns):
+        super().__init__("Missing required columns")
+        self.columns = columns
+
+
+class SpreadsheetReadError(ValueError):
+    """Raised when the spreadsheet itself can't be read, as opposed to a database failure"""
+
+
+def find_column_match(columns, possible_names):
+    columns_lower = [str(col or '').lower().strip() for col in columns]
+    for name in possible_names:
+        if name in columns_lower:
+            return columns_lower.index(name)
+    return None
+
+
+def normalize_email(username):
+    return f"{username.replace(' ', '').lower()}@ames.edu.eu"
+
+
+def text_column(values):
+    """Convert a column of spreadsheet cells to stripped text, with blanks as empty strings
+
+    Whole numbers read as floats ("101.0") are written without the decimal part.
+    """
+    text = values.astype(str).str.strip().str.replace(WHOLE_NUMBER, r"\1", regex=True)
+    return text.mask(values.isna(), "")
+
+
+def stored_text(value):
+    """Convert a stored value the way text_column converts a cell, so 4, 4.0 and "4" compare equal"""
+    if value is None or value != value:  # NaN
+        return ""
+    return re.sub(WHOLE_NUMBER, r"\1", str(value).strip())
+
+
+def read_rows(fileobj, mime_type):
+    """Yield the rows of the first sheet one at a time, header row first
+
+    fileobj may be a path, which lets the readers open the spooled upload directly.
+    Any failure of the underlying reader is raised as SpreadsheetReadError.
+    """
+    rows = _read_rows(fileobj, mime_type)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except Exception as e:
+            raise SpreadsheetReadError(str(e)) from e
+        yield row
+
+
+def _read_rows(fileobj, mime_type):
+    if mime_type == PARSED_MIME_TYPE:
+        yield from read_parsed_rows(fileobj)
+    elif mime_type == XLSX_MIME_TYPE:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        # Legacy .xls has no streaming reader, but the format is capped at 65,536 rows
+        df = pd.read_excel(fileobj, header=None, dtype=object)
+        yield from df.itertuples(index=False, name=None)
+
+
+def read_parsed_rows(path):
+    """Yield archived parsed rows as spreadsheet rows, with blank rows where the original had them
+
+    Keeping the original row numbers means a re-applied upload reports the same rows.
+    """
+    yield PARSED_HEADER
+    with open(path, encoding="utf-8") as source:
+        row_number = 2
+        for line in source:
+            record = json.loads(line)
+            while row_number < record["row"]:
+                yield ()
+                row_number += 1
+            yield tuple(record[field] for field in PARSED_FIELDS)
+            row_number += 1
+
+
+def write_parsed_rows(data, target):
+    """Append the non-blank rows of a validated chunk to a parsed-rows file"""
+    parsed = data[["row", *PARSED_FIELDS]].assign(in_use=data["in_use"].map({True: "Y", False: "N"}))
+    for record in parsed.to_dict("records"):
+        target.write(json.dumps(record) + "\n")
+
+
+def initial_password(username):
+    """Password given to module leads created by an upload when activation emails are off"""
+    return username.replace(" ", "").lower()
+
+
+def prepare_new_users(new_users):
+    """Give new users their credentials just before they are inserted
+
+    Passwords are hashed across the hashing pool in one go. With UPLOAD_ACCOUNT_SETUP
+    set to "activation" no password is hashed at all: each account gets a single-use
+    activation token instead, and the payloads for the activation emails are returned.
+    """
+    if current_app.config.get("UPLOAD_ACCOUNT_SETUP") == "activation":
+        activations = []
+        for user in new_users:
+            token, fields = activation_fields()
+            user.update(fields)
+            activations.append({
+                "recipient_email": user["email"],
+                "username": user["username"],
+                "token": token,
+                "expires_at": fields["activation_expires_at"].strftime("%d %B %Y %H:%M")
+            })
+        return activations
+
+    hashes = hash_passwords(initial_password(user["username"]) for user in new_users)
+    for user, password_hash in zip(new_users, hashes):
+        user["password"] = password_hash
+    return []
+
+
+def handle_user_creation(username, existing_users, duplicates, new_users, warnings):
+    if not username:
+        return False, None
+
+    email = normalize_email(username)
+
+    # Check if user already exists
+    if username in existing_users:
+        return True, ObjectId(existing_users[username]['id'])  # Return ObjectId
+
+    if username in duplicates['users']:
+        return True, ObjectId(duplicates['users'][username])  # Return already created user's ObjectId
+
+    # Create new user
+    user_data = {
+        "_id": ObjectId(),  # Generate ObjectId
+        "username": username,
+        "email": email,
+        "password": None,  # Set in bulk by prepare_new_users
+        "role": "module_lead",
+        "is_active": True
+    }
+    new_users.append(user_data)
+    duplicates['users'][username] = str(user_data['_id'])
+    existing_users[username] = {'id': str(user_data['_id']), 'email': email}
+    return True, user_data['_id']
+
+
+def insert_new(collection, documents):
+    """Insert documents, letting unique indexes reject the ones that already exist
+
+    Returns the documents that were inserted, the ones rejected as duplicates and
+    the messages of any other write errors.
+    """
+    try:
+        collection.insert_many(documents, ordered=False)
+        return list(documents), [], []
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        failed = {error["index"] for error in write_errors}
+        inserted = [document for index, document in enumerate(documents) if index not in failed]
+        conflicts = [documents[error["index"]] for error in write_errors if error["code"] == DUPLICATE_KEY_ERROR]
+        failures = [
+            f"Some records failed to insert: {error['errmsg']}"
+            for error in write_errors if error["code"] != DUPLICATE_KEY_ERROR
+        ]
+        return inserted, conflicts, failures
+
+
+def read_chunks(rows, chunk_size):
+    """Group rows into lists of up to chunk_size rows"""
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_chunk(chunk, first_row_number, column_mapping, find_existing, seen_codes):
+    """Validate a chunk of rows column-wise
+
+    find_existing is called with the chunk's valid codes and returns those already stored.
+    Returns a frame with a text column per mapped field, the spreadsheet row number,
+    the in_use flag and the outcome of each non-blank row: "new", "duplicate" or
+    "invalid", with the message for rows that are not new. seen_codes is updated
+    with the codes of the new rows so later chunks see them as duplicates.
+    """
+    frame = pd.DataFrame(chunk, dtype=object)
+    cells = frame.apply(text_column)
+    blank = cells.eq("").all(axis=1)
+
+    data = pd.DataFrame({
+        key: cells[index] if index in cells.columns else "" for key, index in column_mapping.items()
+    }, index=cells.index)
+    for key in EXCEL_COLUMNS:
+        if key not in data.columns:
+            data[key] = ""
+    data["row"] = data.index + first_row_number
+    data = data[~blank].copy()
+
+    codes = data["module_code"]
+    missing = data[list(REQUIRED_FIELDS)].eq("").any(axis=1)
+    bad_code = ~(codes.str.fullmatch(MODULE_CODE_PATTERN) | codes.str.fullmatch(ALTERNATE_MODULE_CODE_PATTERN))
+    invalid = missing | bad_code
+
+    # Only valid rows can be duplicates; the first valid row of a code in the file wins
+    candidates = codes.where(~invalid)
+    existing_modules = find_existing(candidates.dropna().unique().tolist())
+    duplicate = ~invalid & (candidates.isin(existing_modules) | candidates.isin(seen_codes) | candidates.duplicated())
+    seen_codes.update(codes[~invalid & ~duplicate])
+
+    rows = data["row"].astype(str)
+    data["status"] = "new"
+    data["message"] = ""
+    data.loc[duplicate, "status"] = "duplicate"
+    data.loc[invalid, "status"] = "invalid"
+    data.loc[bad_code, "message"] = "Row " + rows + ": Invalid module code '" + codes + "'"
+    data.loc[missing, "message"] = "Row " + rows + ": Missing required fields"
+    data["in_use"] = data["in_use"].str.lower().isin(IN_USE_VALUES)
+    return data
+
+
+def ingest_modules(fileobj, mime_type, academic_year=None, chunk_size=INSERT_CHUNK_SIZE, progress=None,
+                   dry_run=False, mode="insert", capture=None):
+    """Stream modules from a spreadsheet into the database and return an upload summary
+
+    Rows are read chunk_size at a time, validated column-wise and the chunk's new
+    modules and users inserted, so memory use does not grow with the size of the file.
+    progress, if given, is called with the running counts after each chunk.
+
+    In "sync" mode modules already stored for the year are updated to match the
+    spreadsheet instead of being skipped, with one bulk_write of upserts per chunk.
+
+    With dry_run nothing is written and the summary also holds a diff listing the
+    new, duplicate and invalid rows and the users that would be created.
+
+    capture, if given, is a text file the parsed rows are written to so the upload
+    can later be re-applied without parsing the spreadsheet again.
+    """
+    if mode not in UPLOAD_MODES:
+        raise ValueError(f"Invalid upload mode: {mode}")
+    if academic_year is None:
+        academic_year = get_academic_year()
+    sync = mode == "sync"
+
+    rows = read_rows(fileobj, mime_type)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise ValueError("The spreadsheet is empty")
+    except SpreadsheetReadError:
+        raise ValueError("Error reading the Excel file")
+
+    column_mapping = {}
+    missing_columns = []
+    for key, possible_names in EXCEL_COLUMNS.items():
+        matched_col = find_column_match(header, possible_names)
+        if matched_col is not None:
+            column_mapping[key] = matched_col
+        elif key != 'in_use':
+            missing_columns.append(f"{key} ({'/'.join(possible_names)})")
+
+    if missing_columns:
+        raise MissingColumnsError(missing_columns)
+
+    errors = []
+    warnings = []
+    stats = {"total_processed": 0, "modules_added": 0, "users_added": 0, "academic_year": academic_year}
+    duplicates = {'modules': set(), 'users': {}}
+    diff = {"new_modules": [], "duplicates": [], "invalid": [], "new_users": []}
+    if sync:
+        stats.update({"mode": mode, "modules_updated": 0, "modules_unchanged": 0})
+        diff["updated_modules"] = []
+    insert_failed = False
+
+    # Users looked up or created so far, by username; only names that appear in the file are loaded
+    existing_users = {}
+
+    def find_existing(codes):
+        # A sync updates stored modules, so only repeats within the file are duplicates
+        if not codes or sync:
+            return set()
+        return {
+            m["module_code"]
+            for m in mongo.db.modules.find(
+                {"academic_year": academic_year, "module_code": {"$in": codes}}, {"module_code": 1}
+            )
+        }
+
+    def load_users(usernames):
+        usernames = [name for name in set(usernames) if name and name not in existing_users]
+        if usernames:
+            for u in mongo.db.users.find({"username": {"$in": usernames}}, {"username": 1, "email": 1}):
+                existing_users[u["username"]] = {'id': str(u['_id']), 'email': u['email']}
+
+    new_modules = []
+    new_users = []
+
+    def reassign_conflicting_users(conflicts):
+        """Point modules at the existing accounts that own the emails of users that could not be created"""
+        owners = {
+            u["email"]: u["_id"]
+            for u in mongo.db.users.find({"email": {"$in": [user["email"] for user in conflicts]}}, {"email": 1})
+        }
+        replaced = {}
+        for user in conflicts:
+            owner_id = owners.get(user["email"])
+            replaced[user["_id"]] = owner_id
+            if owner_id:
+                existing_users[user["username"]] = {'id': str(owner_id), 'email': user["email"]}
+                duplicates['users'][user["username"]] = str(owner_id)
+                warnings.append(f"User '{user['username']}' matches the existing account {user['email']} - modules assigned to it")
+        for module in new_modules:
+            if module["module_lead_id"] in replaced:
+                module["module_lead_id"] = replaced[module["module_lead_id"]]
+
+    def sync_modules():
+        """Compare the pending modules with the stored ones and upsert the differences"""
+        nonlocal insert_failed
+        stored = {
+            m["module_code"]: m
+            for m in mongo.db.modules.find(
+                {"academic_year": academic_year, "module_code": {"$in": [m["module_code"] for m in new_modules]}},
+                {"module_code": 1, "academic_year": 1, "review_submitted": 1, **{field: 1 for field in SYNC_FIELDS}}
+            )
+        }
+
+        operations = []
+        planned = []
+        for module in new_modules:
+            current = stored.get(module["module_code"])
+            if current is None:
+                fields = {key: value for key, value in module.items() if key != "review_submitted"}
+                operations.append(UpdateOne(
+                    {"module_code": module["module_code"], "academic_year": academic_year},
+                    {"$set": fields, "$setOnInsert": {"review_submitted": False}},
+                    upsert=True
+                ))
+                planned.append((module, None, None))
+                continue
+
+            # Older modules may hold the level as a number rather than the text a parsed row has
+            stored_values = {**current, "level": stored_text(current.get("level"))}
+            changes = {field: module[field] for field in SYNC_FIELDS if stored_values.get(field) != module[field]}
+            if not changes:
+                stats["modules_unchanged"] += 1
+                continue
+
+            operations.append(UpdateOne(
+                {"_id": current["_id"]},
+                {"$set": {**changes, "search_keys": module["search_keys"]}}
+            ))
+            planned.append((module, current, changes))
+
+        if dry_run:
+            # Rows for stored modules are listed as updates, or not at all when nothing changed
+            diff["new_modules"] = [row for row in diff["new_modules"] if row["module_code"] not in stored]
+            stats["modules_added"] += sum(1 for _, current, _ in planned if current is None)
+            stats["modules_updated"] += sum(1 for _, current, _ in planned if current is not None)
+            diff["updated_modules"].extend(
+                {
+                    "module_code": module["module_code"],
+                    "changes": {field: [current.get(field), value] for field, value in changes.items()}
+                }
+                for module, current, changes in planned if current is not None
+            )
+            return
+
+        if not operations:
+            return
+
+        try:
+            result = mongo.db.modules.bulk_write(operations, ordered=False)
+            failed = set()
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            failed = {error["index"] for error in write_errors}
+            upserted = {item["index"] for item in e.details.get("upserted", [])}
+            errors.extend(f"Some records failed to update: {error['errmsg']}" for error in write_errors)
+            insert_failed = True
+
+        inserted = []
+        for index, (module, current, changes) in enumerate(planned):
+            if index in failed:
+                continue
+            if current is None:
+                if index in upserted:
+                    inserted.append(module)
+                continue
+            stats["modules_updated"] += 1
+            if "module_lead_id" in changes:
+                counters.record_module_lead_changed(current, changes["module_lead_id"])
+
+        if inserted:
+            counters.record_modules_added(inserted)
+        stats["modules_added"] += len(inserted)
+
+    def flush():
+        nonlocal insert_failed
+        if dry_run:
+            stats["users_added"] += len(new_users)
+            diff["new_users"].extend({"username": user["username"], "email": user["email"]} for user in new_users)
+            if sync and new_modules:
+                sync_modules()
+            else:
+                stats["modules_added"] += len(new_modules)
+        else:
+            try:
+                if new_users:
+                    activations = prepare_new_users(new_users)
+                    inserted, conflicts, failures = insert_new(mongo.db.users, new_users)
+                    if inserted:
+                        counters.record_users_added([user["role"] for user in inserted])
+                    stats["users_added"] += len(inserted)
+                    errors.extend(failures)
+                    insert_failed = insert_failed or bool(failures)
+                    if conflicts:
+                        reassign_conflicting_users(conflicts)
+                    if activations:
+                        inserted_emails = {user["email"] for user in inserted}
+                        activations = [a for a in activations if a["recipient_email"] in inserted_emails]
+                        if activations:
+                            outbox.enqueue("activation", activations)
+                if new_modules and sync:
+                    # Users go first so upserted modules never point at a missing lead
+                    sync_modules()
+                elif new_modules:
+                    inserted, conflicts, failures = insert_new(mongo.db.modules, new_modules)
+                    if inserted:
+                        counters.record_modules_added(inserted)
+                    stats["modules_added"] += len(inserted)
+                    errors.extend(failures)
+                    insert_failed = insert_failed or bool(failures)
+                    # Another upload stored these codes after this chunk was checked
+                    warnings.extend(
+                        f"Module code '{module['module_code']}' already exists for academic year {academic_year} - skipped"
+                        for module in conflicts
+                    )
+            except Exception as e:
+                errors.append(f"Some records failed to insert: {str(e)}")
+                insert_failed = True
+        new_users.clear()
+        new_modules.clear()
+
+    first_row_number = 2
+    read_complete = True
+    try:
+        for chunk in read_chunks(rows, chunk_size):
+            data = validate_chunk(chunk, first_row_number, column_mapping, find_existing, duplicates['modules'])
+            first_row_number += len(chunk)
+            stats["total_processed"] += len(data)
+            if capture:
+                write_parsed_rows(data, capture)
+
+            invalid = data[data["status"] == "invalid"]
+            repeated = data[data["status"] == "duplicate"]
+            new = data[data["status"] == "new"]
+
+            errors.extend(invalid["message"].tolist())
+            if sync:
+                warnings.extend(
+                    f"Row {row_number}: Module code '{code}' appears earlier in the file - skipped"
+                    for row_number, code in zip(repeated["row"], repeated["module_code"])
+                )
+            else:
+                warnings.extend(
+                    f"Module code '{code}' already exists for academic year {academic_year} - skipped"
+                    for code in repeated["module_code"]
+                )
+
+            load_users(new["tutor"])
+            for row in new.itertuples(index=False):
+                # Create or get user ID
+                user_created, user_id = handle_user_creation(
+                    row.tutor, existing_users, duplicates, new_users, warnings
+                )
+
+                new_modules.append({
+                    "module_code": row.module_code,
+                    "code_prefix": row.module_code[:2],  # Extracted code prefix
+                    "module_name": row.module_name,
+                    "level": row.level,
+                    "module_lead_id": user_id if user_id else None,  # Store user ID instead of username
+                    "in_use": bool(row.in_use),
+                    "review_submitted": False,
+                    "academic_year": academic_year,
+                    "search_keys": module_search_keys(row.module_code, row.module_name, row.tutor),
+                })
+
+            if dry_run:
+                diff["new_modules"].extend(
+                    new[["row", "module_code", "module_name", "level", "tutor", "in_use"]]
+                    .rename(columns={"tutor": "module_lead"}).to_dict("records")
+                )
+                diff["duplicates"].extend(repeated[["row", "module_code"]].to_dict("records"))
+                diff["invalid"].extend(
+                    invalid[["row", "module_code", "message"]].rename(columns={"message": "error"}).to_dict("records")
+                )
+
+            flush()
+            if progress:
+                progress({**stats, "warnings": len(warnings), "errors": len(errors)})
+    except SpreadsheetReadError as e:
+        # Database errors are not caught here, so the job fails with their own message
+        errors.append(f"Error reading the Excel file after row {first_row_number - 1}: {str(e)}")
+        read_complete = False
+
+    flush()
+
+    if insert_failed:
+        # A partial insert leaves the increments unknown, so recount instead
+        counters.rebuild_module_counters(academic_year)
+        counters.rebuild_user_counters()
+
+    summary = {"stats": stats, "warnings": warnings, "errors": errors, "read_complete": read_complete}
+    if dry_run:
+        stats["dry_run"] = True
+        summary["diff"] = diff
+    return summary
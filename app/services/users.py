@@ -0,0 +1,190 @@
+import re
+from bson import ObjectId
+from datetime import datetime
+from admin.models import User
+from services import counters
+from services.passwords import hash_password, hash_token
+from services.loaders import get_user_loader
+from services.pagination import decode_cursor, encode_cursor, keyset_condition
+from services.search import reindex_modules
+
+# Fields returned when users are looked up in bulk
+SUMMARY_FIELDS = {"username": 1, "email": 1, "role": 1, "is_active": 1}
+
+# Fields never returned by user listings
+HIDDEN_FIELDS = {"password": 0, "activation_token": 0}
+
+
+def get_user(user_id):
+    """Get a single user document, or None if it does not exist"""
+    user_id = str(user_id).strip()
+    if not ObjectId.is_valid(user_id):
+        raise ValueError("Invalid user ID format")
+
+    return User.get_user_by_id(user_id)
+
+
+def get_users_by_ids(user_ids, projection=None):
+    """Get all users whose ID is in user_ids with a single query"""
+    object_ids = {ObjectId(str(uid)) for uid in user_ids if uid and ObjectId.is_valid(str(uid))}
+    if not object_ids:
+        return []
+
+    return list(User.collection.find({"_id": {"$in": list(object_ids)}}, projection))
+
+
+def user_filter(search="", is_active=None, role=None):
+    """Build the query matching the users list filters"""
+    query = {}
+    if search:
+        pattern = {"$regex": re.escape(search), "$options": "i"}
+        query["$or"] = [
+            {"username": pattern},
+            {"email": pattern}
+        ]
+
+    if is_active is not None:
+        query["is_active"] = is_active
+
+    if role:
+        query["role"] = role
+
+    return query
+
+
+def list_users(search="", is_active=None, role=None, sort_field="username", sort_direction=1,
+               page=1, per_page=10, cursor=None):
+    """Get a page of users matching the filters along with the total count
+
+    When a cursor from a previous page is given, the page starts right after it on
+    (sort_field, _id) instead of skipping, and the total is not counted.
+    """
+    query = user_filter(search, is_active, role)
+
+    # _id keeps the order stable when the sort field has duplicates
+    sort = [(sort_field, sort_direction), ("_id", sort_direction)]
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_field, sort_direction)
+        keyset = keyset_condition(sort_field, sort_direction, value, last_id)
+        users = list(
+            User.collection.find({"$and": [query, keyset]}, HIDDEN_FIELDS)
+            .sort(sort)
+            .limit(per_page + 1)
+        )
+        total = None
+        has_more = len(users) > per_page
+        users = users[:per_page]
+    else:
+        total = User.collection.count_documents(query)
+
+        results = User.collection.find(query, HIDDEN_FIELDS).sort(sort)
+        if per_page:
+            results = results.skip((page - 1) * per_page).limit(per_page)
+        users = list(results)
+        has_more = bool(per_page) and page * per_page < total
+
+    return {
+        "items": users,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "next_cursor": encode_cursor(users[-1], sort_field, sort_direction) if has_more else None
+    }
+
+
+def iter_users(search="", is_active=None, role=None, sort_field="username", sort_direction=1, batch_size=1000):
+    """Yield every user matching the list filters straight from the cursor"""
+    return (
+        User.collection.find(user_filter(search, is_active, role), HIDDEN_FIELDS)
+        .sort([(sort_field, sort_direction), ("_id", sort_direction)])
+        .batch_size(batch_size)
+    )
+
+
+def count_users():
+    """Get user counts by role with a single aggregation"""
+    counts = {"total": 0, "admin": 0, "module_lead": 0}
+    for group in User.collection.aggregate([{"$group": {"_id": "$role", "count": {"$sum": 1}}}]):
+        counts["total"] += group["count"]
+        if group["_id"] in counts:
+            counts[group["_id"]] = group["count"]
+
+    return counts
+
+
+def create_user(username, email, password, role):
+    """Create a user with a hashed password and return the stored document"""
+    if not all([username, email, password, role]):
+        raise ValueError("Missing required fields")
+
+    # Check for existing user by username or email
+    existing_user = User.collection.find_one({
+        "$or": [
+            {"username": username},
+            {"email": email}
+        ]
+    })
+
+    if existing_user:
+        if existing_user["username"] == username:
+            raise ValueError("Username already exists")
+        raise ValueError("Email already exists")
+
+    result = User.collection.insert_one({
+        "username": username,
+        "email": email,
+        "password": hash_password(password),
+        "role": role,
+        "is_active": True,
+        "created_at": datetime.utcnow()
+    })
+    counters.record_users_added([role])
+
+    return User.get_user_by_id(result.inserted_id)
+
+
+def update_user(user_id, data):
+    """Update a user and return the updated document, or None if nothing changed"""
+    user_id = str(user_id).strip()
+    if not ObjectId.is_valid(user_id):
+        raise ValueError("Invalid user ID format")
+
+    previous = User.collection.find_one({"_id": ObjectId(user_id)}, {"role": 1, "username": 1})
+
+    result = User.update_user(user_id, data)
+    if not result.modified_count:
+        return None
+
+    get_user_loader().clear(user_id)
+    user = User.get_user_by_id(user_id)
+    if previous:
+        counters.record_user_role_changed(previous.get("role"), user.get("role"))
+        if previous.get("username") != user.get("username"):
+            # Lead usernames are part of their modules' search keys
+            reindex_modules({"module_lead_id": ObjectId(user_id)})
+    return user
+
+
+def activate_user(token, password):
+    """Set the first password of an account created with an activation token
+
+    The token is removed in the same update, so it can only be used once.
+    Returns the activated user, or None if the token is unknown or expired.
+    """
+    if not token or not password:
+        raise ValueError("Missing required fields")
+
+    query = {"activation_token": hash_token(token), "activation_expires_at": {"$gt": datetime.utcnow()}}
+    # Check the token before paying for the hash
+    if not User.collection.find_one(query, {"_id": 1}):
+        return None
+
+    return User.collection.find_one_and_update(
+        query,
+        {
+            "$set": {"password": hash_password(password), "activated_at": datetime.utcnow()},
+            "$unset": {"activation_token": "", "activation_expires_at": ""}
+        },
+        projection={"password": 0}
+    )
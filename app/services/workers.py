@@ -0,0 +1,61 @@
+import threading
+from flask import current_app
+
+
+class WorkerPool:
+    """Background threads that repeatedly call work() inside an app context until stopped
+
+    work() returns True when it found something to do, so the thread goes again
+    straight away, and False when it is idle, so the thread sleeps for poll_interval.
+    """
+
+    def __init__(self, app, name, work, workers, poll_interval):
+        self.app = app
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.started = False
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.started = True
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    busy = self.work()
+                except Exception as e:
+                    current_app.logger.error(f"{self.name.capitalize()} worker error: {str(e)}")
+                    busy = False
+
+                if not busy:
+                    self._stopped.wait(self.poll_interval)
+
+
+def start_on_first_request(app, pool):
+    """Start a pool when this process handles its first request
+
+    Starting lazily keeps CLI commands, which also build the app, from running background work.
+    """
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_workers():
+        if not pool.started:
+            with lock:
+                if not pool.started:
+                    pool.start()
+
+    return pool
@@ -57,14 +57,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         moduleTable.innerHTML = modules.map(module => `
-            <tr style="cursor: pointer;" onclick="window.location='/admin/modules/${module._id.$oid}/view'">
+            <tr style="cursor: pointer;" onclick="window.location='/admin/modules/${module._id}/view'">
                 <td>${module.module_code || 'N/A'}</td>
                 <td>${module.module_name || 'N/A'}</td>
                 <td>${module.module_lead || 'N/A'}</td>
-                <td>${formatDate(module.review_date?.$date)}</td>
+                <td>${formatDate(module.review_date)}</td>
                 <td>${module.reviewer_name || 'Unknown'}</td>
                 <td>
-                    <a href="/admin/modules/${module._id.$oid}/view" 
+                    <a href="/admin/modules/${module._id}/view" 
                        class="btn btn-sm btn-outline-primary">
                         <i class="fas fa-eye"></i> View
                     </a>
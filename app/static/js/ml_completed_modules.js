@@ -57,14 +57,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         moduleTable.innerHTML = modules.map(module => `
-            <tr class="table-row" data-url="/module-lead/modules/${module._id.$oid}/view">
+            <tr class="table-row" data-url="/module-lead/modules/${module._id}/view">
                 <td class="px-3">${module.module_code || 'N/A'}</td>
                 <td class="px-3">${module.module_name || 'N/A'}</td>
                 <td class="px-3">${module.module_lead || 'N/A'}</td>
-                <td class="px-3">${formatDate(module.review_date?.$date)}</td>
+                <td class="px-3">${formatDate(module.review_date)}</td>
                 <td class="px-3">${module.reviewer_name || 'Unknown'}</td>
                 <td class="px-3 text-end" onclick="event.stopPropagation()">
-                    <a href="/module-lead/modules/${module._id.$oid}/view" 
+                    <a href="/module-lead/modules/${module._id}/view" 
                        class="btn btn-sm btn-outline-primary">
                         <i class="fas fa-eye"></i> View
                     </a>
@@ -163,15 +163,8 @@ function updateTable(modules) {
     }
 
     tableBody.innerHTML = modules.map(module => {
-        // Ensure module._id is properly handled
-        let moduleId;
-        if (typeof module._id === 'object' && module._id.$oid) {
-            moduleId = module._id.$oid;
-        } else if (typeof module._id === 'string') {
-            moduleId = module._id;
-        } else {
-            moduleId = '';
-        }
+        // IDs arrive as plain strings
+        const moduleId = module._id || '';
 
         // Get reviewer name
         const reviewerName = module.reviewer_name || 'N/A';
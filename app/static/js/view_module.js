@@ -102,7 +102,7 @@ function updateReviewInfo(review) {
 
     // Update review date
     if (review.review_date) {
-        const date = new Date(review.review_date.$date);
+        const date = new Date(review.review_date);
         document.querySelector('.review-date').textContent = 
             date.toLocaleDateString('en-GB', { 
                 year: 'numeric', 
@@ -133,7 +133,7 @@ function updateReviewInfo(review) {
                                 <div class="mt-3 pt-2 border-top">
                                     <small class="text-muted">
                                         <i class="fas fa-calendar-alt me-1"></i>
-                                        Added: ${new Date(plan.added_date.$date).toLocaleDateString()}
+                                        Added: ${new Date(plan.added_date).toLocaleDateString()}
                                     </small>
                                 </div>
                             ` : ''}
@@ -0,0 +1,30 @@
+import os
+import sys
+from unittest import mock
+import mongomock
+import pytest
+
+# The app imports its packages from the app directory, as run.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Config reads the environment when it is imported; no background workers or hashing pool in tests
+os.environ.setdefault("MONGO_URI", "mongodb://localhost/ames_test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["EMAIL_OUTBOX_WORKERS"] = "0"
+os.environ["UPLOAD_WORKERS"] = "0"
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The application from run.py, backed by an in-memory mongomock database"""
+    with mock.patch("flask_pymongo.MongoClient", mongomock.MongoClient):
+        import run
+    run.app.config["TESTING"] = True
+    return run.app
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
@@ -0,0 +1,20 @@
+from utils.sessions import MongoSessionInterface
+from utils.spooling import SpoolingRequest
+
+
+def test_create_app_registers_the_blueprints_and_apis(app):
+    assert {"auth", "admin", "module_lead", "base"} <= set(app.blueprints)
+
+    rules = {rule.rule for rule in app.url_map.iter_rules()}
+    assert {"/auth/login", "/auth/api/login", "/admin/api/modules/upload", "/admin/api/outbox/<batch_id>"} <= rules
+
+
+def test_create_app_sets_up_sessions_uploads_and_commands(app):
+    assert isinstance(app.session_interface, MongoSessionInterface)
+    assert app.request_class is SpoolingRequest
+    assert {"indexes", "counters", "search", "outbox", "uploads", "snapshots"} <= set(app.cli.commands)
+
+
+def test_login_page_renders(app):
+    response = app.test_client().get("/auth/login")
+    assert response.status_code == 200
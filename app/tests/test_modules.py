@@ -0,0 +1,16 @@
+import importlib
+import pytest
+from bson import ObjectId
+
+
+@pytest.mark.parametrize("package", ["admin", "module_lead"])
+def test_create_module_rejects_a_duplicate_code_for_the_year(app, app_context, package):
+    models = importlib.import_module(f"{package}.models")
+    code = f"DUP{package.upper()}"
+    models.Module.create_module(code, "DUP", "First", str(ObjectId()), academic_year=2024)
+
+    with pytest.raises(ValueError, match="already exists for academic year 2024"):
+        models.Module.create_module(code, "DUP", "Second", str(ObjectId()), academic_year=2024)
+
+    # The same code can be used again in another year
+    models.Module.create_module(code, "DUP", "Next year", str(ObjectId()), academic_year=2025)
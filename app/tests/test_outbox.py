@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+import pytest
+from extensions import mongo
+
+
+@pytest.fixture
+def outbox(app, app_context):
+    from services import outbox
+    mongo.db.email_outbox.delete_many({})
+    return outbox
+
+
+def payload(email):
+    return {"recipient_email": email, "subject": "Hello", "message": "Hi"}
+
+
+def test_enqueue_rejects_unknown_kinds_and_empty_batches(outbox):
+    with pytest.raises(ValueError):
+        outbox.enqueue("newsletter", [payload("a@ames.edu.eu")])
+    with pytest.raises(ValueError):
+        outbox.enqueue("custom", [])
+
+
+def test_claimed_message_is_leased_until_it_expires(outbox):
+    outbox.enqueue("custom", [payload("a@ames.edu.eu")])
+
+    message = outbox.claim_next()
+    assert message["status"] == "sending"
+    assert message["attempts"] == 1
+    assert outbox.claim_next() is None
+
+    # Expire the lease, as if the worker holding it had died
+    mongo.db.email_outbox.update_one(
+        {"_id": message["_id"]}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+    reclaimed = outbox.claim_next()
+    assert reclaimed["_id"] == message["_id"]
+    assert reclaimed["attempts"] == 2
+
+
+def test_failed_message_is_retried_with_backoff_then_given_up(app, outbox):
+    batch_id = outbox.enqueue("custom", [payload("a@ames.edu.eu")])
+
+    message = outbox.claim_next()
+    outbox.mark_failed(message, "SMTP down")
+    stored = mongo.db.email_outbox.find_one({"_id": message["_id"]})
+    assert stored["status"] == "queued"
+    assert stored["next_attempt_at"] > datetime.utcnow()
+    assert outbox.claim_next() is None
+
+    outbox.mark_failed({**message, "attempts": app.config.get("EMAIL_MAX_ATTEMPTS", 5)}, "SMTP down")
+    assert outbox.batch_status(batch_id)["counts"]["failed"] == 1
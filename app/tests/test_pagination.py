@@ -0,0 +1,51 @@
+import mongomock
+import pytest
+from bson import ObjectId
+from services.pagination import decode_cursor, encode_cursor, keyset_condition
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.items
+    collection.insert_many([
+        {"_id": ObjectId(), "name": name, "lead": {"name": lead}}
+        for name, lead in [("b", "x"), ("a", None), ("c", "y"), ("a", "x"), (None, None), ("b", None), (None, "z")]
+    ])
+    return collection
+
+
+def test_cursor_round_trip():
+    document = {"_id": ObjectId(), "lead": {"name": "Ada"}}
+    cursor = encode_cursor(document, "lead.name", -1)
+    assert decode_cursor(cursor, "lead.name", -1) == ("Ada", document["_id"])
+
+
+def test_cursor_round_trip_with_a_missing_value():
+    document = {"_id": ObjectId()}
+    cursor = encode_cursor(document, "lead.name", 1)
+    assert decode_cursor(cursor, "lead.name", 1) == (None, document["_id"])
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24=", encode_cursor({"_id": ObjectId()}, "name", -1)])
+def test_decode_cursor_rejects_malformed_or_mismatched_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "name", 1)
+
+
+@pytest.mark.parametrize("sort_field", ["name", "lead.name"])
+@pytest.mark.parametrize("sort_direction", [1, -1])
+def test_keyset_pages_visit_every_document_once(collection, sort_field, sort_direction):
+    order = [(sort_field, sort_direction), ("_id", sort_direction)]
+    expected = [document["_id"] for document in collection.find(sort=order)]
+
+    seen = []
+    query = {}
+    while True:
+        page = list(collection.find(query, sort=order, limit=2))
+        if not page:
+            break
+        seen.extend(document["_id"] for document in page)
+        value, last_id = decode_cursor(encode_cursor(page[-1], sort_field, sort_direction), sort_field, sort_direction)
+        query = keyset_condition(sort_field, sort_direction, value, last_id)
+
+    assert seen == expected
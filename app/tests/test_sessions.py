@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from extensions import mongo
+
+
+def session_cookie(client, app):
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"])
+    return cookie.value if cookie else None
+
+
+def test_session_is_stored_under_an_opaque_id(app):
+    client = app.test_client()
+    client.post("/auth/api/login", json={"email": "admin@ames.edu.eu", "password": "admin123"})
+
+    sid, _, rev = session_cookie(client, app).partition(".")
+    with app.app_context():
+        stored = mongo.db.sessions.find_one({"_id": sid})
+    assert stored["rev"] == rev
+    assert stored["data"]["_user_id"]
+
+
+def test_login_moves_the_session_to_a_new_id(app):
+    with app.app_context():
+        mongo.db.sessions.insert_one({
+            "_id": "planted",
+            "rev": "r1",
+            "data": {"theme": "dark"},
+            "expires_at": datetime.utcnow() + timedelta(hours=1)
+        })
+
+    client = app.test_client()
+    client.set_cookie(app.config["SESSION_COOKIE_NAME"], "planted.r1")
+    response = client.post("/auth/api/login", json={"email": "admin@ames.edu.eu", "password": "admin123"})
+    assert response.status_code == 200
+
+    sid, _, _ = session_cookie(client, app).partition(".")
+    assert sid != "planted"
+    with app.app_context():
+        assert mongo.db.sessions.find_one({"_id": "planted"}) is None
+        # Data set before login is carried over to the new ID
+        assert mongo.db.sessions.find_one({"_id": sid})["data"]["theme"] == "dark"
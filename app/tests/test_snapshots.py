@@ -0,0 +1,76 @@
+from datetime import datetime
+import pyarrow.parquet as pq
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def snapshots(app):
+    # The services import the models, which need the database the app fixture sets up
+    from services import snapshots
+    return snapshots
+
+
+def make_review(module_id, ratings, plans, edited):
+    return {
+        "_id": ObjectId(),
+        "module_id": module_id,
+        "reviewer_id": ObjectId(),
+        "review_date": datetime(2024, 11, 1),
+        "engagement_rating": ratings[0],
+        "learning_environment_rating": ratings[1],
+        "timetabling_rating": ratings[2],
+        "enhancement_plan_update": "Update",
+        "student_attainment": "Attainment",
+        "student_feedback": "Feedback",
+        "risks": "Risks",
+        "enhancement_plans": [{"plan": plan, "details": f"{plan} details"} for plan in plans],
+        "last_edit": {"edit_date": edited},
+        "edit_count": 1,
+    }
+
+
+def read(app, name):
+    return pq.read_table(f"{app.config['SNAPSHOT_DIR']}/2024/{name}").to_pylist()
+
+
+def test_full_then_incremental_refresh(app, app_context, snapshots, tmp_path, monkeypatch):
+    app.config["SNAPSHOT_DIR"] = str(tmp_path)
+    first = make_review(ObjectId(), (4, 3, 2), ["Assessment", "Teaching"], datetime(2024, 11, 1))
+    second = make_review(ObjectId(), (1, 1, 1), ["Concerns"], datetime(2024, 11, 2))
+    edited = {**second, "timetabling_rating": 4, "enhancement_plans": [{"plan": "Admissions", "details": "New"}]}
+
+    monkeypatch.setattr(snapshots, "_write_modules", lambda directory, academic_year: 0)
+    monkeypatch.setattr(snapshots, "_year_reviews", lambda academic_year: [(first, "AC101"), (second, "AC102")])
+    monkeypatch.setattr(snapshots, "_changed_reviews", lambda academic_year, since: [(edited, "AC102")])
+
+    full = snapshots.refresh_snapshot(2024, full=True)
+    assert full["incremental"] is False
+    assert full["counts"]["reviews"] == 2
+    assert full["counts"]["enhancement_plans"] == 3
+
+    incremental = snapshots.refresh_snapshot(2024)
+    assert incremental["incremental"] is True
+    assert incremental["counts"] == {"modules": 0, "reviews": 2, "enhancement_plans": 3, "reviews_read": 1}
+
+    reviews = {row["review_id"]: row for row in read(app, "reviews.parquet")}
+    assert reviews[str(first["_id"])]["timetabling_rating"] == 2
+    assert reviews[str(second["_id"])]["timetabling_rating"] == 4
+
+    plans = sorted((row["module_code"], row["plan"]) for row in read(app, "enhancement_plans.parquet"))
+    assert plans == [("AC101", "Assessment"), ("AC101", "Teaching"), ("AC102", "Admissions")]
+
+    schema = pq.read_schema(f"{tmp_path}/2024/reviews.parquet")
+    assert str(schema.field("engagement_rating").type) == "int8"
+
+
+def test_incremental_refresh_reads_since_last_watermark(app, app_context, snapshots, tmp_path, monkeypatch):
+    app.config["SNAPSHOT_DIR"] = str(tmp_path)
+    seen = []
+    monkeypatch.setattr(snapshots, "_write_modules", lambda directory, academic_year: 0)
+    monkeypatch.setattr(snapshots, "_year_reviews", lambda academic_year: [])
+    monkeypatch.setattr(snapshots, "_changed_reviews", lambda academic_year, since: seen.append(since) or [])
+
+    full = snapshots.refresh_snapshot(2024, full=True)
+    snapshots.refresh_snapshot(2024)
+    assert seen == [full["watermark"]]
@@ -0,0 +1,52 @@
+import pytest
+from datetime import datetime
+from openpyxl import Workbook
+from extensions import mongo
+
+
+@pytest.fixture
+def uploads(app):
+    from services import uploads
+    return uploads
+
+
+def spreadsheet(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Module Code", "Name", "Level", "Tutor", "In Use"])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def test_sync_treats_a_numeric_stored_level_as_unchanged(app, app_context, uploads, tmp_path):
+    lead_id = mongo.db.users.insert_one(
+        {"username": "Sync Tutor", "email": "synctutor@ames.edu.eu", "role": "module_lead"}
+    ).inserted_id
+    # Modules stored before levels were kept as text hold the number read from the spreadsheet
+    mongo.db.modules.insert_one({
+        "module_code": "SY10001",
+        "module_name": "Synced Module",
+        "level": 4.0,
+        "module_lead_id": lead_id,
+        "in_use": True,
+        "academic_year": 2030,
+        "review_submitted": False,
+        "created_at": datetime.utcnow()
+    })
+    path = spreadsheet(tmp_path / "modules.xlsx", [
+        ["SY10001", "Synced Module", 4, "Sync Tutor", "Yes"],
+    ])
+
+    summary = uploads.ingest_modules(path, uploads.XLSX_MIME_TYPE, 2030, mode="sync", dry_run=True)
+    assert summary["errors"] == []
+    assert summary["stats"]["modules_unchanged"] == 1
+    assert summary["diff"]["updated_modules"] == []
+
+
+@pytest.mark.parametrize("value, expected", [
+    (4, "4"), (4.0, "4"), (" 4 ", "4"), ("4.5", "4.5"), (None, ""), (float("nan"), "")
+])
+def test_stored_text_matches_text_column(uploads, value, expected):
+    assert uploads.stored_text(value) == expected
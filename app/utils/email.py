@@ -1,171 +1,198 @@
+import os
+import smtplib
+import time
 from flask import current_app
 from flask_mail import Message
 from extensions import mail
 from datetime import datetime
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 
-def send_reminder_email(recipient_email, modules_info):
+# Each email has an HTML template and a plain-text alternative
+EMAIL_TEMPLATES = (
+    "reminder.html", "reminder.txt", "custom.html", "custom.txt", "activation.html", "activation.txt"
+)
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "emails")
+
+_environment = None
+
+
+def create_email_environment(cache_dir=None):
+    """Create the Jinja environment for email templates with a bytecode cache on disk"""
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    else:
+        # Jinja's default is a temp directory private to this user, checked for ownership before use
+        bytecode_cache = FileSystemBytecodeCache()
+
+    environment = Environment(
+        loader=FileSystemLoader(EMAIL_TEMPLATE_DIR),
+        autoescape=select_autoescape(["html"]),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+        cache_size=len(EMAIL_TEMPLATES)
+    )
+
+    # Compile every template up front so sending only ever renders
+    for name in EMAIL_TEMPLATES:
+        environment.get_template(name)
+    return environment
+
+
+def init_email_templates(app):
+    """Compile the email templates once when the app starts"""
+    global _environment
+    _environment = create_email_environment(app.config.get("EMAIL_TEMPLATE_CACHE_DIR"))
+
+
+def get_email_environment():
+    global _environment
+    if _environment is None:
+        _environment = create_email_environment(current_app.config.get("EMAIL_TEMPLATE_CACHE_DIR"))
+    return _environment
+
+
+def render_email(name, **context):
+    """Render the HTML and plain-text parts of an email template"""
+    environment = get_email_environment()
+    html = environment.get_template(f"{name}.html").render(**context)
+    text = environment.get_template(f"{name}.txt").render(**context)
+    return html, text
+
+
+def build_reminder_message(recipient_email, modules_info):
     """
-    Send a reminder email to module leads about pending module reviews
-    
+    Build the reminder email for a module lead about pending module reviews
+
     Args:
         recipient_email (str): The email address of the module lead
         modules_info (list): List of dictionaries containing module details
                            [{'code': 'ABC123', 'name': 'Module Name'}, ...]
     """
-    try:
-        # Email template using Jinja2 for better formatting
-        template = Template("""
-        <html>
-        <body style="font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; background-color: #f5f5f5; margin: 0; padding: 0;">
-            <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); margin-top: 20px;">
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <h2 style="color: #1a73e8; margin: 0; padding-bottom: 15px; font-size: 24px; border-bottom: 2px solid #e0e0e0;">
-                        Module Review Reminder
-                    </h2>
-                </div>
-                
-                <p style="color: #424242; font-size: 16px;">Dear Module Lead,</p>
-                
-                <p style="color: #424242; font-size: 16px;">This is a friendly reminder that the following module(s) are pending review:</p>
-                
-                <div style="margin: 25px 0;">
-                    {% for module in modules %}
-                    <div style="margin: 15px 0; padding: 15px; background-color: #f8f9fa; border-radius: 6px; border-left: 4px solid #1a73e8; transition: all 0.3s ease;">
-                        <div style="font-size: 18px; font-weight: 600; color: #1a73e8;">{{ module.code }}</div>
-                        <div style="color: #616161; margin-top: 5px;">{{ module.name }}</div>
-                    </div>
-                    {% endfor %}
-                </div>
-                
-                <p style="color: #424242; font-size: 16px; background-color: #e3f2fd; padding: 15px; border-radius: 6px; margin: 20px 0;">
-                    Please complete the module review(s) at your earliest convenience. 
-                    The review process is essential for maintaining academic quality and planning improvements.
-                </p>
-                
-                <div style="margin-top: 30px; padding: 20px; background-color: #f5f5f5; border-radius: 6px;">
-                    <p style="color: #424242; font-size: 16px; margin-top: 0;">To complete the review(s), please:</p>
-                    <ol style="color: #424242; font-size: 16px; padding-left: 20px;">
-                        <li style="margin-bottom: 10px;">Log in to the Module Review System</li>
-                        <li style="margin-bottom: 10px;">Navigate to your pending reviews</li>
-                        <li style="margin-bottom: 10px;">Complete the review form for each module</li>
-                    </ol>
-                </div>
-                
-                <div style="text-align: center; margin: 35px 0;">
-                    <a href="{{ system_url }}" 
-                       style="display: inline-block; background-color: #1a73e8; color: white; padding: 12px 30px; 
-                              text-decoration: none; border-radius: 25px; font-weight: 500; font-size: 16px;
-                              transition: background-color 0.3s ease;">
-                        Access Module Review System
-                    </a>
-                </div>
-                
-                <div style="margin-top: 40px; padding-top: 20px; border-top: 1px solid #e0e0e0;">
-                    <p style="color: #757575; font-size: 14px; text-align: center; margin: 0;">
-                        This is an automated message. If you have any questions, please contact the system administrator.
-                    </p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """)
-
-        # Render the template with the module data
-        html_content = template.render(
-            modules=modules_info,
-            system_url=f"{current_app.config['SYSTEM_URL']}/auth/login",
-            current_year=datetime.now().year
-        )
-
-        # Create the email message
-        msg = Message(
-            subject='Action Required: Pending Module Reviews',
-            recipients=[recipient_email],
-            html=html_content,
-            sender=current_app.config['MAIL_DEFAULT_SENDER']
-        )
-
-        # Send the email
-        mail.send(msg)
-        
-        # Log the email sending
-        current_app.logger.info(f"Reminder email sent to {recipient_email} for {len(modules_info)} modules")
-        
-        return True
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to send reminder email to {recipient_email}: {str(e)}")
-        raise
-
-def send_custom_email(recipient_email, subject, message, sender_email):
+    html_content, text_content = render_email(
+        "reminder",
+        modules=modules_info,
+        system_url=f"{current_app.config['SYSTEM_URL']}/auth/login",
+        current_year=datetime.now().year
+    )
+
+    return Message(
+        subject='Action Required: Pending Module Reviews',
+        recipients=[recipient_email],
+        body=text_content,
+        html=html_content,
+        sender=current_app.config['MAIL_DEFAULT_SENDER']
+    )
+
+def build_custom_message(recipient_email, subject, message, sender_email):
     """
-    Send a custom email to a user
-    
+    Build a custom email to a user
+
     Args:
         recipient_email (str): The email address of the recipient
         subject (str): Email subject
         message (str): Email message content
         sender_email (str): The email address of the sender
     """
-    try:
-        # Email template using Jinja2 for formatting
-        template = Template("""
-        <html>
-        <body style="font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; background-color: #f5f5f5; margin: 0; padding: 0;">
-            <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); margin-top: 20px;">
-                <div style="text-align: center; margin-bottom: 30px;">
-                    <h2 style="color: #1a73e8; margin: 0; padding-bottom: 15px; font-size: 24px; border-bottom: 2px solid #e0e0e0;">
-                        {{ subject }}
-                    </h2>
-                </div>
-                
-                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 6px; border-left: 4px solid #1a73e8; margin: 25px 0;">
-                    <div style="color: #424242; font-size: 16px;">
-                        {{ message | safe }}
-                    </div>
-                </div>
-                
-                <div style="margin-top: 30px; padding: 20px; background-color: #f5f5f5; border-radius: 6px;">
-                    <p style="color: #666; font-size: 14px; margin-top: 0;">
-                        This email was sent by {{ sender_email }} via the Module Review System.
-                    </p>
-                </div>
-                
-                <div style="margin-top: 40px; padding-top: 20px; border-top: 1px solid #e0e0e0;">
-                    <p style="color: #757575; font-size: 14px; text-align: center; margin: 0;">
-                        © {{ current_year }} Module Review System. All rights reserved.
-                    </p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """)
-
-        # Render the template
-        html_content = template.render(
-            subject=subject,
-            message=message,
-            sender_email=sender_email,
-            current_year=datetime.now().year
-        )
-
-        # Create the email message
-        msg = Message(
-            subject=subject,
-            recipients=[recipient_email],
-            html=html_content,
-            sender=sender_email
-        )
-
-        # Send the email
-        mail.send(msg)
-        
-        # Log the email sending
-        current_app.logger.info(f"Custom email sent from {sender_email} to {recipient_email}")
-        
-        return True
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to send custom email to {recipient_email}: {str(e)}")
-        raise
+    html_content, text_content = render_email(
+        "custom",
+        subject=subject,
+        message=message,
+        sender_email=sender_email,
+        current_year=datetime.now().year
+    )
+
+    return Message(
+        subject=subject,
+        recipients=[recipient_email],
+        body=text_content,
+        html=html_content,
+        sender=sender_email
+    )
+
+def build_activation_message(recipient_email, username, token, expires_at):
+    """
+    Build the email that lets a new user choose their first password
+
+    Args:
+        recipient_email (str): The email address of the new user
+        username (str): The username of the new user
+        token (str): The single-use activation token
+        expires_at (str): When the token expires, formatted for display
+    """
+    html_content, text_content = render_email(
+        "activation",
+        username=username,
+        activation_url=f"{current_app.config['SYSTEM_URL']}/auth/activate/{token}",
+        expires_at=expires_at,
+        current_year=datetime.now().year
+    )
+
+    return Message(
+        subject='Activate your Module Review System account',
+        recipients=[recipient_email],
+        body=text_content,
+        html=html_content,
+        sender=current_app.config['MAIL_DEFAULT_SENDER']
+    )
+
+
+class BatchSender:
+    """Send many messages over one SMTP connection, reconnecting when it drops
+
+    The connection is opened on the first send, so an empty run never connects.
+    Counts and timings for the run are kept in stats.
+    """
+
+    # Errors that mean the connection is gone rather than the message being refused
+    CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+    def __init__(self):
+        self._connection = None
+        self._started = None
+        self.stats = {"sent": 0, "failed": 0, "connections": 0, "reconnects": 0, "seconds": 0.0}
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._disconnect()
+        self.stats["seconds"] = round(time.monotonic() - self._started, 3)
+        seconds = self.stats["seconds"]
+        self.stats["messages_per_second"] = round(self.stats["sent"] / seconds, 2) if seconds else None
+        return False
+
+    def _connect(self):
+        connection = mail.connect()
+        connection.__enter__()
+        self._connection = connection
+        self.stats["connections"] += 1
+
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self._connection = None
+
+    def send(self, message):
+        """Send a message, reconnecting once if the connection has dropped"""
+        for attempt in range(2):
+            try:
+                if self._connection is None:
+                    self._connect()
+                self._connection.send(message)
+                self.stats["sent"] += 1
+                return
+            except self.CONNECTION_ERRORS:
+                self._disconnect()
+                if attempt:
+                    self.stats["failed"] += 1
+                    raise
+                self.stats["reconnects"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+
@@ -0,0 +1,73 @@
+import json
+from datetime import date, datetime, timezone
+from bson import ObjectId
+from flask import Response, current_app, make_response, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+
+NDJSON_MIME_TYPE = "application/x-ndjson"
+
+# Lines are sent to the client in blocks of this many documents
+NDJSON_BATCH_LINES = 100
+
+
+def to_json_value(value):
+    """Convert a BSON value the json module cannot encode on its own"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Mongo returns naive datetimes that are in UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+def dumps(data):
+    """Encode data to compact JSON bytes in a single pass"""
+    return json.dumps(data, default=to_json_value, separators=(",", ":")).encode()
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """JSON provider used by jsonify that writes ObjectIds as strings and dates as ISO 8601"""
+    default = staticmethod(to_json_value)
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation that writes the payload straight to the response"""
+    response = make_response(dumps(data), code)
+    response.mimetype = "application/json"
+    response.headers.extend(headers or {})
+    return response
+
+
+def wants_ndjson():
+    """Whether the client asked for a newline-delimited JSON stream, with Accept or stream=true"""
+    if request.args.get("stream", "false").lower() == "true":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIME_TYPE]) == NDJSON_MIME_TYPE
+
+
+def ndjson_response(documents):
+    """Stream documents as one JSON line each while they are read from the cursor
+
+    The status is sent before the first document, so an error part way through is
+    reported as a last line of the form {"error": "..."}.
+    """
+    def generate():
+        lines = []
+        try:
+            for document in documents:
+                lines.append(dumps(document))
+                if len(lines) >= NDJSON_BATCH_LINES:
+                    yield b"\n".join(lines) + b"\n"
+                    lines = []
+        except Exception as e:
+            current_app.logger.error(f"NDJSON stream failed: {str(e)}")
+            lines.append(dumps({"error": str(e)}))
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIME_TYPE)
@@ -0,0 +1,187 @@
+import copy
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app, session as current_session
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from extensions import mongo
+
+
+class MongoSession(CallbackDict, SessionMixin):
+    """Session whose data lives in the sessions collection under an opaque ID"""
+
+    def __init__(self, initial=None, sid=None, rev=None, expires_at=None, cookie_rev=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.rev = rev
+        self.expires_at = expires_at
+        # Revision the browser sent, which is behind rev when another request saved in between
+        self.cookie_rev = cookie_rev
+        self.new = sid is None
+        self.modified = False
+
+
+class MongoSessionInterface(SessionInterface):
+    """Keep session data in MongoDB, so the cookie only carries "<session ID>.<revision>"
+
+    The revision changes whenever the data is saved, so a process can answer from its
+    in-process cache only while the browser still holds the revision it cached; any
+    newer write, from whichever process, is read from the database instead.
+    """
+
+    def __init__(self, cache_size=1024, cache_seconds=60, refresh_seconds=3600):
+        self.cache_size = cache_size
+        self.cache_seconds = cache_seconds
+        # Expiry is only pushed back once it is this much older than a fresh session's
+        self.refresh_seconds = refresh_seconds
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        return mongo.db.sessions
+
+    def _cached(self, sid, rev):
+        if not self.cache_seconds:
+            return None
+        with self._lock:
+            entry = self._cache.get(sid)
+            if not entry or entry["rev"] != rev or entry["cached_until"] < time.monotonic():
+                return None
+            self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_put(self, sid, rev, data, expires_at):
+        if not self.cache_seconds:
+            return
+        with self._lock:
+            self._cache[sid] = {
+                "rev": rev,
+                "data": data,
+                "expires_at": expires_at,
+                "cached_until": time.monotonic() + self.cache_seconds
+            }
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _load(self, sid, rev):
+        """Get the stored session as a (rev, data, expires_at) tuple, or None if it has expired"""
+        entry = self._cached(sid, rev)
+        if entry and entry["expires_at"] > datetime.utcnow():
+            return entry["rev"], entry["data"], entry["expires_at"]
+
+        document = self._collection().find_one({"_id": sid, "expires_at": {"$gt": datetime.utcnow()}})
+        if not document:
+            self._cache_drop(sid)
+            return None
+
+        self._cache_put(sid, document["rev"], document["data"], document["expires_at"])
+        return document["rev"], document["data"], document["expires_at"]
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app), "")
+        sid, _, rev = value.partition(".")
+        if sid and rev:
+            stored = self._load(sid, rev)
+            if stored:
+                stored_rev, data, expires_at = stored
+                # Nested values such as the flashed messages list are changed in place
+                return MongoSession(
+                    copy.deepcopy(data), sid=sid, rev=stored_rev, expires_at=expires_at, cookie_rev=rev
+                )
+        return MongoSession()
+
+    def regenerate(self, session):
+        """Drop the stored session and have the next save issue it under a new ID
+
+        Called on login, so a session ID planted in the browser beforehand is useless afterwards.
+        """
+        if session.sid:
+            self._collection().delete_one({"_id": session.sid})
+            self._cache_drop(session.sid)
+        session.sid = None
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified and not session.new:
+                self._collection().delete_one({"_id": session.sid})
+                self._cache_drop(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+            return
+
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        expires_at = now + lifetime
+
+        if session.modified or session.new:
+            session.sid = session.sid or secrets.token_urlsafe(32)
+            session.rev = secrets.token_urlsafe(8)
+            data = dict(session)
+            self._collection().update_one(
+                {"_id": session.sid},
+                {"$set": {"rev": session.rev, "data": data, "expires_at": expires_at}},
+                upsert=True
+            )
+            self._cache_put(session.sid, session.rev, copy.deepcopy(data), expires_at)
+        elif session.expires_at < expires_at - timedelta(seconds=self.refresh_seconds):
+            self._collection().update_one({"_id": session.sid}, {"$set": {"expires_at": expires_at}})
+            self._cache_put(session.sid, session.rev, copy.deepcopy(dict(session)), expires_at)
+        elif session.cookie_rev == session.rev and not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            f"{session.sid}.{session.rev}",
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite
+        )
+
+
+def regenerate_session():
+    """Move the current session to a new ID when it is kept in MongoDB
+
+    Cookie sessions carry their data rather than an ID, so there is nothing to rotate.
+    """
+    interface = current_app.session_interface
+    if isinstance(interface, MongoSessionInterface):
+        interface.regenerate(current_session)
+
+
+def init_session_store(app):
+    """Keep sessions in MongoDB unless SESSION_STORE is set to cookie"""
+    if app.config.get("SESSION_STORE", "mongo") != "mongo":
+        return None
+
+    app.session_interface = MongoSessionInterface(
+        cache_size=app.config.get("SESSION_CACHE_SIZE", 1024),
+        cache_seconds=app.config.get("SESSION_CACHE_SECONDS", 60)
+    )
+    return app.session_interface
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+from flask import Request, current_app
+
+
+def upload_dir():
+    """Directory uploaded spreadsheets are spooled to and kept in until their job has run"""
+    path = current_app.config.get("UPLOAD_JOB_DIR") or os.path.join(current_app.instance_path, "uploads")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+class SpoolingRequest(Request):
+    """Request that writes uploaded files once, straight to a named file in upload_dir()
+
+    Werkzeug would otherwise keep small files in memory and big ones in an anonymous
+    temporary file, so they had to be read back into memory to be sniffed, parsed or
+    saved. A named file can be handed to magic and openpyxl by path and hard-linked
+    into place for a job without copying any bytes.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile("w+b", dir=upload_dir(), prefix="spool-", suffix=".upload")
+
+
+def stream_path(stream):
+    """Path of the file behind an upload stream, or None if it is not a named file"""
+    path = getattr(stream, "name", None)
+    return path if isinstance(path, str) and os.path.isfile(path) else None
+
+
+def stream_size(stream):
+    """Size of an upload stream in bytes, without reading it"""
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+
+
+def keep_upload(stream, path):
+    """Keep the contents of an upload stream at path, linking the spooled file when possible"""
+    source = stream_path(stream)
+    if source:
+        try:
+            os.link(source, path)
+            return
+        except OSError:
+            pass
+
+    stream.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(stream, target)